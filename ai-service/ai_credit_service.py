@@ -1,52 +1,45 @@
-from flask import Flask, request, jsonify
-from sklearn.linear_model import LogisticRegression
+from flask import Flask, Response, request, jsonify, stream_with_context
+from itertools import islice
 import numpy as np
-import pandas as pd
-import joblib
+import json
 import os
+import time
+from credit_model import FEATURE_NAMES, load_artifact, save_artifact, train_model
 
 app = Flask(__name__)
 
-# Global model and backup data
+# Global model and the metadata of its artifact
 model = None
-backup_data = None
+model_metadata = None
 
-def load_backup_data():
-    """Load backup training data from CSV"""
-    try:
-        backup_path = os.path.join(os.path.dirname(__file__), 'data', 'credit_training_backup.csv')
-        return pd.read_csv(backup_path)
-    except Exception as e:
-        print(f"Failed to load backup data: {e}")
-        return None
+# Startup timing breakdown, seconds per phase
+startup_timings = {}
+
+# Records scored per predict_proba call by the batch endpoint
+BATCH_CHUNK_SIZE = int(os.getenv('CREDIT_BATCH_CHUNK_SIZE', 5000))
 
 def initialize_model():
-    """Initialize model with backup data or dummy data"""
-    global model, backup_data
+    """Load the published model artifact, training one in memory if none exists"""
+    global model, model_metadata
     
     try:
-        backup_data = load_backup_data()
+        start = time.perf_counter()
+        model, model_metadata = load_artifact(os.getenv('CREDIT_MODEL_VERSION'))
         
-        if backup_data is not None:
-            X = backup_data[['avgPaymentDelay', 'creditLimitUsage', 'overdueRatio', 'transactionVolume']].values
-            y = backup_data['riskLabel'].values
+        if model is not None:
+            startup_timings['model_load'] = round(time.perf_counter() - start, 3)
         else:
-            # Fallback to dummy data
-            X = np.array([
-                [5, 0.3, 0.1, 1000], [15, 0.7, 0.4, 500], [8, 0.5, 0.2, 800],
-                [3, 0.2, 0.05, 1200], [20, 0.9, 0.6, 300]
-            ])
-            y = np.array([0, 1, 0, 0, 1])
-        
-        model = LogisticRegression()
-        model.fit(X, y)
-        print("Model initialized successfully")
+            print("No published credit model, training in memory (publish one with credit_model.py)")
+            model, model_metadata = train_model()
+            startup_timings['model_fit'] = round(time.perf_counter() - start, 3)
         
+        print(f"Model {model_metadata['version']} initialized successfully {startup_timings}")
+    
     except Exception as e:
         print(f"Model initialization failed: {e}")
-        model = None
+        model, model_metadata = None, None
 
-# Initialize on startup
+# Load on startup
 initialize_model()
 
 def calculate_risk_score(features):
@@ -76,6 +69,110 @@ def get_risk_level(score):
     else:
         return "High"
 
+def get_risk_levels(scores):
+    """Convert an array of scores to risk levels"""
+    return np.where(scores < 30, "Low", np.where(scores < 70, "Moderate", "High"))
+
+def calculate_risk_scores(X, scoring_model):
+    """Calculate credit risk scores from 0-100 for a feature matrix"""
+    if scoring_model is not None:
+        try:
+            probability = scoring_model.predict_proba(X)[:, 1]
+            return np.clip((probability * 100).astype(int), 0, 100)
+        except Exception as e:
+            print(f"Batch model prediction failed: {e}")
+    
+    # Same formula as fallback_risk_score, one row per customer
+    score = (X[:, 0] * 2) + (X[:, 1] * 50) + (X[:, 2] * 100)
+    return np.clip(np.trunc(score), 0, 100).astype(int)
+
+def record_features(record):
+    """Validated feature row for one batch record"""
+    if not isinstance(record, dict):
+        raise ValueError("Record must be a JSON object")
+    
+    features = [float(record.get(name, 0)) for name in FEATURE_NAMES]
+    if not np.isfinite(features).all():
+        raise ValueError("Features must be finite numbers")
+    return features
+
+def features_matrix(records):
+    """
+    Validate batch records into one feature matrix
+    
+    Returns:
+        tuple: (matrix of the valid records, their positions in records,
+            error message per invalid position)
+    """
+    # Fast path: the whole chunk converts cleanly in one go
+    try:
+        X = np.array([[record.get(name, 0) for name in FEATURE_NAMES] for record in records], dtype='float64')
+        if np.isfinite(X).all():
+            return X.reshape(len(records), len(FEATURE_NAMES)), np.arange(len(records)), {}
+    except (AttributeError, TypeError, ValueError):
+        pass
+    
+    X = np.zeros((len(records), len(FEATURE_NAMES)))
+    valid = np.ones(len(records), dtype=bool)
+    errors = {}
+    
+    for position, record in enumerate(records):
+        try:
+            X[position] = record_features(record)
+        except (TypeError, ValueError) as e:
+            valid[position] = False
+            errors[position] = str(e)
+    
+    return X[valid], np.flatnonzero(valid), errors
+
+def score_batch(records, offset, scoring_model):
+    """Score a chunk of batch records into NDJSON result lines"""
+    X, positions, errors = features_matrix(records)
+    scores = calculate_risk_scores(X, scoring_model)
+    levels = get_risk_levels(scores)
+    
+    results = [None] * len(records)
+    for position, score, level in zip(positions.tolist(), scores.tolist(), levels.tolist()):
+        results[position] = {'creditRiskScore': score, 'riskLevel': level}
+    for position, error in errors.items():
+        results[position] = {'error': error}
+    
+    lines = []
+    for position, (record, result) in enumerate(zip(records, results)):
+        line = {'index': offset + position}
+        if isinstance(record, dict) and 'id' in record:
+            line['id'] = record['id']
+        line.update(result)
+        lines.append(json.dumps(line))
+    
+    return '\n'.join(lines) + '\n'
+
+def batch_records():
+    """
+    Iterate the feature records of a batch request
+    
+    NDJSON bodies are read line by line as they arrive; JSON bodies must be
+    an array of records or an object with a records array.
+    """
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        def read_lines():
+            for line in request.stream:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # Scored as an invalid record rather than ending the stream
+                    yield None
+        return read_lines()
+    
+    data = request.get_json()
+    records = data.get('records') if isinstance(data, dict) else data
+    if not isinstance(records, list):
+        raise ValueError("Expected an array of feature records")
+    return iter(records)
+
 @app.route('/predict-credit-risk', methods=['POST'])
 def predict_credit_risk():
     try:
@@ -110,7 +207,7 @@ def predict_credit_risk():
                 }
             }
         })
-        
+    
     except Exception as e:
         print(f"Prediction error: {e}")
         return jsonify({
@@ -119,24 +216,102 @@ def predict_credit_risk():
             'fallback': True
         }), 400
 
+@app.route('/predict-credit-risk/batch', methods=['POST'])
+def predict_credit_risk_batch():
+    """
+    Score many customers in one request
+    
+    Streams one NDJSON line per record, in input order, with the record's
+    index (and id, if it has one) and either its score and risk level or a
+    validation error. Records are scored BATCH_CHUNK_SIZE at a time.
+    """
+    try:
+        records = batch_records()
+    except Exception as e:
+        print(f"Batch prediction error: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    
+    # Keep scoring with one model even if /retrain swaps it mid-stream
+    scoring_model = model
+    
+    def generate():
+        offset = 0
+        while True:
+            chunk = list(islice(records, BATCH_CHUNK_SIZE))
+            if not chunk:
+                break
+            yield score_batch(chunk, offset, scoring_model)
+            offset += len(chunk)
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={'X-Model-Status': 'active' if scoring_model else 'fallback'}
+    )
+
 @app.route('/health', methods=['GET'])
 def health_check():
     return jsonify({
         'status': 'healthy', 
         'service': 'ai_credit_service',
         'modelStatus': 'active' if model else 'fallback',
-        'backupDataLoaded': backup_data is not None
+        'modelVersion': model_metadata['version'] if model_metadata else None,
+        'startupTimings': startup_timings
+    })
+
+@app.route('/model', methods=['GET'])
+def model_info():
+    """Metadata of the model being served"""
+    return jsonify({
+        'success': True,
+        'data': model_metadata,
+        'modelStatus': 'active' if model else 'fallback'
     })
 
 @app.route('/retrain', methods=['POST'])
 def retrain_model():
-    """Retrain model with backup data"""
+    """Train and publish a new model version from the backup data, then serve it"""
+    global model, model_metadata
+    
     try:
-        initialize_model()
+        new_model, metadata = train_model()
+        save_artifact(new_model, metadata)
+        model, model_metadata = new_model, metadata
+        
         return jsonify({
             'success': True,
             'message': 'Model retrained successfully',
-            'modelStatus': 'active' if model else 'failed'
+            'modelStatus': 'active',
+            'modelVersion': metadata['version'],
+            'metrics': metadata['metrics']
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/reload-model', methods=['POST'])
+def reload_model():
+    """Switch to the latest published (or CREDIT_MODEL_VERSION pinned) model"""
+    global model, model_metadata
+    
+    try:
+        new_model, metadata = load_artifact(os.getenv('CREDIT_MODEL_VERSION'))
+        if new_model is None:
+            return jsonify({
+                'success': False,
+                'error': 'No published credit model'
+            }), 404
+        
+        model, model_metadata = new_model, metadata
+        return jsonify({
+            'success': True,
+            'modelStatus': 'active',
+            'modelVersion': metadata['version']
         })
     except Exception as e:
         return jsonify({
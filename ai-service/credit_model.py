@@ -0,0 +1,159 @@
+"""
+Credit risk model training and versioned artifacts
+
+Training runs offline and publishes each model as a versioned directory
+under CREDIT_MODEL_DIR holding model.joblib and metadata.json, then points
+LATEST at it. The credit service loads the latest (or the CREDIT_MODEL_VERSION
+pinned) artifact at startup, so every worker serves the same model.
+
+Usage:
+    python credit_model.py [--data PATH] [--model-dir DIR] [--if-missing]
+"""
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+import joblib
+import numpy as np
+
+# Model input columns, in training order
+FEATURE_NAMES = ['avgPaymentDelay', 'creditLimitUsage', 'overdueRatio', 'transactionVolume']
+
+LABEL_NAME = 'riskLabel'
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DATA_PATH = os.path.join(BASE_DIR, 'data', 'credit_training_backup.csv')
+MODEL_DIR = os.getenv('CREDIT_MODEL_DIR', os.path.join(BASE_DIR, 'models', 'credit'))
+
+def file_hash(path):
+    """SHA-256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def train_model(data_path=DEFAULT_DATA_PATH):
+    """
+    Fit the credit risk model on a training CSV
+    
+    Returns:
+        tuple: (fitted model, metadata dict)
+    """
+    import pandas as pd
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.metrics import accuracy_score, log_loss, roc_auc_score
+    import sklearn
+    
+    data = pd.read_csv(data_path)
+    X = data[FEATURE_NAMES].to_numpy(dtype='float64')
+    y = data[LABEL_NAME].to_numpy()
+    
+    start = time.perf_counter()
+    model = LogisticRegression()
+    model.fit(X, y)
+    fit_seconds = time.perf_counter() - start
+    
+    probability = model.predict_proba(X)[:, 1]
+    metrics = {
+        'training_accuracy': round(float(accuracy_score(y, model.predict(X))), 4),
+        'training_log_loss': round(float(log_loss(y, probability)), 4)
+    }
+    if len(np.unique(y)) > 1:
+        metrics['training_roc_auc'] = round(float(roc_auc_score(y, probability)), 4)
+    
+    data_hash = file_hash(data_path)
+    trained_at = datetime.utcnow()
+    
+    metadata = {
+        'version': f"{trained_at:%Y%m%d%H%M%S}-{data_hash[:8]}",
+        'features': FEATURE_NAMES,
+        'label': LABEL_NAME,
+        'model_class': type(model).__name__,
+        'sklearn_version': sklearn.__version__,
+        'training_data': os.path.basename(data_path),
+        'training_data_sha256': data_hash,
+        'training_rows': int(len(y)),
+        'positive_rate': round(float(np.mean(y)), 4),
+        'metrics': metrics,
+        'fit_seconds': round(fit_seconds, 3),
+        'trained_at': trained_at.isoformat() + 'Z'
+    }
+    
+    return model, metadata
+
+def save_artifact(model, metadata, model_dir=MODEL_DIR):
+    """
+    Write a model version and point LATEST at it
+    
+    Returns:
+        str: Directory of the new version
+    """
+    version_dir = os.path.join(model_dir, metadata['version'])
+    os.makedirs(version_dir, exist_ok=True)
+    
+    # Uncompressed, so workers can memory-map the coefficient arrays
+    joblib.dump(model, os.path.join(version_dir, 'model.joblib'))
+    with open(os.path.join(version_dir, 'metadata.json'), 'w') as f:
+        json.dump(metadata, f, indent=2)
+    
+    # Swap the pointer atomically so readers never see a partial write
+    fd, temp_path = tempfile.mkstemp(dir=model_dir)
+    with os.fdopen(fd, 'w') as f:
+        f.write(metadata['version'])
+    os.replace(temp_path, os.path.join(model_dir, 'LATEST'))
+    
+    return version_dir
+
+def latest_version(model_dir=MODEL_DIR):
+    """Version LATEST points at, or None if nothing was published"""
+    try:
+        with open(os.path.join(model_dir, 'LATEST')) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def load_artifact(version=None, model_dir=MODEL_DIR):
+    """
+    Load a published model version, the latest one by default
+    
+    Returns:
+        tuple: (model, metadata), or (None, None) if nothing was published
+    
+    Raises:
+        ValueError: If the artifact was trained on other features
+    """
+    version = version or latest_version(model_dir)
+    if version is None:
+        return None, None
+    
+    version_dir = os.path.join(model_dir, version)
+    with open(os.path.join(version_dir, 'metadata.json')) as f:
+        metadata = json.load(f)
+    
+    if metadata.get('features') != FEATURE_NAMES:
+        raise ValueError(f"Model {version} expects features {metadata.get('features')}, not {FEATURE_NAMES}")
+    
+    model = joblib.load(os.path.join(version_dir, 'model.joblib'), mmap_mode='r')
+    return model, metadata
+
+def main():
+    parser = argparse.ArgumentParser(description='Train and publish the credit risk model')
+    parser.add_argument('--data', default=DEFAULT_DATA_PATH, help='Training CSV')
+    parser.add_argument('--model-dir', default=MODEL_DIR, help='Artifact directory')
+    parser.add_argument('--if-missing', action='store_true', help='Only train if no model is published yet')
+    args = parser.parse_args()
+    
+    if args.if_missing and latest_version(args.model_dir):
+        print(f"Credit model {latest_version(args.model_dir)} already published")
+        return
+    
+    model, metadata = train_model(args.data)
+    version_dir = save_artifact(model, metadata, args.model_dir)
+    print(f"Published credit model {metadata['version']} to {version_dir} {metadata['metrics']}")
+
+if __name__ == '__main__':
+    main()
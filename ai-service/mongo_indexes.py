@@ -0,0 +1,28 @@
+"""
+MongoDB indexes backing the AI service queries
+
+Creating an index on a large collection can take a while, so the service
+never builds them on a request; run this once per deploy before starting
+the workers. Creating an index that already exists is a no-op.
+
+Usage:
+    python mongo_indexes.py [--mongo-uri URI]
+"""
+import argparse
+import os
+from src.services.data_service import AI_SERVICE_INDEXES, ensure_indexes, get_mongo_client
+
+def main():
+    parser = argparse.ArgumentParser(description='Create the MongoDB indexes used by the AI service')
+    parser.add_argument('--mongo-uri', default=os.getenv('MONGO_URI'), help='MongoDB connection string')
+    args = parser.parse_args()
+    
+    if not args.mongo_uri:
+        print("MONGO_URI is not set, skipping index creation")
+        return
+    
+    created = ensure_indexes(get_mongo_client(args.mongo_uri).setledger)
+    print(f"Ensured {len(created)} indexes on {', '.join(AI_SERVICE_INDEXES)}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""
+Benchmark of pricing feature preparation against the row-by-row original
+
+Times PricingService._prepare_features on synthetic columnar sales
+histories and compares it with the per-row loop it replaced, after checking
+that both build the same frame. Sizes above --legacy-max run the loop on the
+first --legacy-max rows and extrapolate linearly, as it takes minutes there.
+
+Usage:
+    python scripts/bench_pricing_features.py [--sizes 1000 10000 100000] [--legacy-max 10000]
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.services.columnar import SALES_COLUMNS, records_to_columns
+from src.services.pricing_service import PricingService
+
+COMPETITOR_PRICES = [{'price': 90.0}, {'price': 120.0}, {'price': 99.5}]
+PRODUCT_DATA = {'cost_price': 40.5}
+
+def legacy_prepare_features(service, product_data, sales_history, competitor_prices):
+    """The row-by-row _prepare_features, kept as the baseline"""
+    df = service._sales_frame(sales_history)
+    
+    features = []
+    for i in range(len(df)):
+        row = df.iloc[i]
+        
+        feature_row = {
+            'price': row.get('unit_price', 0),
+            'quantity_sold': row.get('quantity', 0),
+            'cost_price': product_data.get('cost_price', 0),
+            'day_of_week': row['date'].dayofweek,
+            'month': row['date'].month,
+            'is_weekend': 1 if row['date'].dayofweek >= 5 else 0
+        }
+        
+        if i >= 7:
+            recent_data = df.iloc[i-7:i]
+            feature_row.update({
+                'avg_price_7d': recent_data['unit_price'].mean() if 'unit_price' in recent_data else 0,
+                'avg_quantity_7d': recent_data['quantity'].mean() if 'quantity' in recent_data else 0,
+                'price_trend_7d': (recent_data['unit_price'].iloc[-1] - recent_data['unit_price'].iloc[0]) if len(recent_data) > 1 else 0
+            })
+        else:
+            feature_row.update({
+                'avg_price_7d': feature_row['price'],
+                'avg_quantity_7d': feature_row['quantity_sold'],
+                'price_trend_7d': 0
+            })
+        
+        if competitor_prices:
+            feature_row.update({
+                'min_competitor_price': min([p['price'] for p in competitor_prices]),
+                'max_competitor_price': max([p['price'] for p in competitor_prices]),
+                'avg_competitor_price': np.mean([p['price'] for p in competitor_prices]),
+                'price_vs_competitors': feature_row['price'] - np.mean([p['price'] for p in competitor_prices])
+            })
+        else:
+            feature_row.update({
+                'min_competitor_price': feature_row['price'],
+                'max_competitor_price': feature_row['price'],
+                'avg_competitor_price': feature_row['price'],
+                'price_vs_competitors': 0
+            })
+        
+        feature_row['revenue'] = feature_row['price'] * feature_row['quantity_sold']
+        feature_row['margin'] = feature_row['price'] - feature_row['cost_price']
+        feature_row['margin_percent'] = (feature_row['margin'] / feature_row['price']) * 100 if feature_row['price'] > 0 else 0
+        
+        features.append(feature_row)
+    
+    return pd.DataFrame(features)
+
+def synthetic_sales(size, rng):
+    """Sales records at random minutes, a few per hour on average"""
+    dates = pd.Timestamp('2024-01-01') + pd.to_timedelta(np.sort(rng.integers(0, size * 60, size)), 'm')
+    quantities = rng.integers(0, 20, size)
+    prices = rng.uniform(50, 150, size).round(2)
+    
+    return [
+        {'date': date.isoformat(), 'quantity': int(quantity), 'unit_price': float(price), 'total_amount': 0, 'discount': 0}
+        for date, quantity, price in zip(dates, quantities, prices)
+    ]
+
+def check_equal(service, rng):
+    """Both implementations build the same frame for records and columns"""
+    for size in (50, 10, 8):
+        records = synthetic_sales(size, rng)
+        for sales_history in (records, records_to_columns(records, SALES_COLUMNS)):
+            for competitor_prices in (COMPETITOR_PRICES, None):
+                for product_data in (PRODUCT_DATA, {}):
+                    pd.testing.assert_frame_equal(
+                        legacy_prepare_features(service, product_data, sales_history, competitor_prices),
+                        service._prepare_features(product_data, sales_history, competitor_prices)
+                    )
+
+def timed(function, *args):
+    """Seconds one call takes"""
+    started = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark pricing feature preparation')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000], help='Sales history lengths')
+    parser.add_argument('--legacy-max', type=int, default=10000, help='Longest history to run the row loop on')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    args = parser.parse_args()
+    
+    rng = np.random.default_rng(args.seed)
+    service = PricingService()
+    
+    check_equal(service, rng)
+    print("Vectorized and row-by-row features are identical")
+    print(f"{'rows':>8}  {'row loop':>12}  {'vectorized':>12}  {'speedup':>8}")
+    
+    for size in args.sizes:
+        sales_history = records_to_columns(synthetic_sales(size, rng), SALES_COLUMNS)
+        vectorized = timed(service._prepare_features, PRODUCT_DATA, sales_history, COMPETITOR_PRICES)
+        
+        if size <= args.legacy_max:
+            legacy = timed(legacy_prepare_features, service, PRODUCT_DATA, sales_history, COMPETITOR_PRICES)
+            note = ''
+        else:
+            head = {column: values[:args.legacy_max] for column, values in sales_history.items()}
+            legacy = timed(legacy_prepare_features, service, PRODUCT_DATA, head, COMPETITOR_PRICES) * size / args.legacy_max
+            note = '  (row loop extrapolated)'
+        
+        print(f"{size:>8}  {legacy * 1000:>10.1f}ms  {vectorized * 1000:>10.2f}ms  {legacy / vectorized:>7.0f}x{note}")
+
+if __name__ == '__main__':
+    main()
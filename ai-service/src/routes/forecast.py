@@ -2,9 +2,8 @@ from flask import Blueprint, request, jsonify
 import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
-from sklearn.linear_model import LinearRegression
-from sklearn.preprocessing import StandardScaler
 import logging
+from ..services.lazy_imports import lazy_import
 
 forecast_bp = Blueprint('forecast', __name__)
 logger = logging.getLogger(__name__)
@@ -80,7 +79,7 @@ def generate_forecast(data, forecast_days, data_type):
         y = df['value'].values
         
         # Fit linear regression
-        model = LinearRegression()
+        model = lazy_import('sklearn.linear_model').LinearRegression()
         model.fit(X, y)
         
         # Generate future predictions
@@ -0,0 +1,60 @@
+from flask import Blueprint, request, jsonify
+from ..services.data_service import DataService
+from ..services.job_service import JobService
+
+job_bp = Blueprint('jobs', __name__)
+job_service = JobService(DataService())
+
+@job_bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Get job status and progress"""
+    job = job_service.get(job_id)
+    if job is None:
+        return jsonify({
+            'success': False,
+            'error': 'Job not found'
+        }), 404
+    
+    return jsonify({
+        'success': True,
+        'data': job
+    })
+
+@job_bp.route('/jobs/<job_id>/results', methods=['GET'])
+def get_job_results(job_id):
+    """Get a page of job results"""
+    try:
+        page = max(1, int(request.args.get('page', 1)))
+        limit = min(1000, max(1, int(request.args.get('limit', 100))))
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'error': 'page and limit must be integers'
+        }), 400
+    
+    results = job_service.get_results(job_id, page, limit)
+    if results is None:
+        return jsonify({
+            'success': False,
+            'error': 'Job not found'
+        }), 404
+    
+    return jsonify({
+        'success': True,
+        'data': results
+    })
+
+@job_bp.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Cancel a queued or running job"""
+    job = job_service.cancel(job_id)
+    if job is None:
+        return jsonify({
+            'success': False,
+            'error': 'Job not found'
+        }), 404
+    
+    return jsonify({
+        'success': True,
+        'data': job
+    })
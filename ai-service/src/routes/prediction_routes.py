@@ -1,10 +1,22 @@
+import os
 from flask import Blueprint, request, jsonify
 from ..services.forecasting_service import ForecastingService
 from ..services.data_service import DataService
+from ..services.lazy_imports import import_report
+from ..services.series_store import StockSeriesStore
+from ..services.snapshot_service import (
+    DepletionSnapshotService, TREND_BUCKETS, classify_depletion, summarize_trends
+)
+from .job_routes import job_service
 
 prediction_bp = Blueprint('prediction', __name__)
 forecasting_service = ForecastingService()
 data_service = DataService()
+snapshot_service = DepletionSnapshotService(data_service, forecasting_service)
+series_store = StockSeriesStore(data_service)
+
+if os.getenv('SNAPSHOT_SCHEDULER', 'false') == 'true':
+    snapshot_service.start()
 
 @prediction_bp.route('/predict/stock-depletion', methods=['POST'])
 def predict_stock_depletion():
@@ -20,8 +32,6 @@ def predict_stock_depletion():
                 'error': 'org_id and product_id are required'
             }), 400
         
-        # Get stock movement data
-        stock_data = data_service.get_stock_data(org_id, product_id)
         product_info = data_service.get_product_info(org_id, product_id)
         
         if not product_info:
@@ -30,8 +40,15 @@ def predict_stock_depletion():
                 'error': 'Product not found'
             }), 404
         
+        # Stock series kept up to date incrementally, shared by the prediction
+        # and the insights
+        stock_data = series_store.get(org_id, product_id)
+        
         # Generate prediction
-        prediction = forecasting_service.predict_stock_depletion(stock_data, product_info)
+        prediction = forecasting_service.predict_stock_depletion(
+            stock_data, product_info, org_id, product_id,
+            budget_ms=data.get('budget_ms')
+        )
         
         # Get additional insights
         insights = forecasting_service.get_stock_insights(stock_data, product_info)
@@ -54,6 +71,36 @@ def predict_stock_depletion():
             'error': str(e)
         }), 500
 
+def _forecast_products(stock_by_product, info_by_product, org_id, engine):
+    """
+    Forecast many products with the chosen engine
+    
+    'batch' runs the vectorized engine and escalates only ambiguous products
+    to Prophet/ARIMA; 'full' runs the full model for every product.
+    """
+    if engine == 'batch':
+        return forecasting_service.predict_batch(stock_by_product, info_by_product, org_id)
+    
+    product_ids = list(info_by_product)
+    results = forecasting_service.predict_many([
+        (stock_by_product.get(product_id, []), info_by_product[product_id], org_id, product_id)
+        for product_id in product_ids
+    ])
+    return dict(zip(product_ids, results))
+
+def _prediction_row(product_id, product_info, prediction):
+    """Summary row for one product in bulk depletion results"""
+    return {
+        'product_id': product_id,
+        'product_name': product_info.get('name', ''),
+        'current_stock': product_info.get('current_stock', 0),
+        'min_stock': product_info.get('min_stock', 0),
+        'depletion_date': prediction.get('depletion_date'),
+        'days_remaining': prediction.get('days_remaining'),
+        'confidence': prediction.get('confidence', 0),
+        'method': prediction.get('method', 'unknown')
+    }
+
 @prediction_bp.route('/predict/bulk-depletion', methods=['POST'])
 def predict_bulk_depletion():
     """Predict stock depletion for multiple products"""
@@ -74,29 +121,24 @@ def predict_bulk_depletion():
             product_ids = [p['product_id'] for p in products]
         
         predictions = []
+        product_ids = product_ids[:20]  # Limit to 20 products
         
-        for product_id in product_ids[:20]:  # Limit to 20 products
-            try:
-                stock_data = data_service.get_stock_data(org_id, product_id)
-                product_info = data_service.get_product_info(org_id, product_id)
-                
-                if product_info:
-                    prediction = forecasting_service.predict_stock_depletion(stock_data, product_info)
-                    
-                    predictions.append({
-                        'product_id': product_id,
-                        'product_name': product_info.get('name', ''),
-                        'current_stock': product_info.get('current_stock', 0),
-                        'min_stock': product_info.get('min_stock', 0),
-                        'depletion_date': prediction.get('depletion_date'),
-                        'days_remaining': prediction.get('days_remaining'),
-                        'confidence': prediction.get('confidence', 0),
-                        'method': prediction.get('method', 'unknown')
-                    })
-                    
-            except Exception as e:
-                print(f"Error predicting for product {product_id}: {e}")
-                continue
+        # Fetch all products and their movements in batch rather than per product
+        stock_by_product = data_service.get_stock_data_bulk(org_id, product_ids)
+        info_by_product = data_service.get_product_info_bulk(org_id, product_ids)
+        
+        forecast_ids = [product_id for product_id in product_ids if info_by_product.get(product_id)]
+        results = _forecast_products(
+            stock_by_product,
+            {product_id: info_by_product[product_id] for product_id in forecast_ids},
+            org_id,
+            data.get('engine', 'batch')
+        )
+        
+        for product_id in forecast_ids:
+            predictions.append(
+                _prediction_row(product_id, info_by_product[product_id], results[product_id])
+            )
         
         # Sort by days remaining (ascending)
         predictions.sort(key=lambda x: x['days_remaining'] if x['days_remaining'] is not None else float('inf'))
@@ -116,6 +158,48 @@ def predict_bulk_depletion():
             'error': str(e)
         }), 500
 
+@prediction_bp.route('/jobs/forecast', methods=['POST'])
+def submit_forecast_job():
+    """Queue a depletion forecast job covering all (or the given) products"""
+    try:
+        data = request.get_json()
+        org_id = data.get('org_id')
+        product_ids = data.get('product_ids', [])
+        engine = data.get('engine', 'batch')
+        
+        if not org_id:
+            return jsonify({
+                'success': False,
+                'error': 'org_id is required'
+            }), 400
+        
+        if not product_ids:
+            products = data_service.get_all_products_for_org(org_id)
+            product_ids = [p['product_id'] for p in products]
+        
+        def forecast_chunk(org_id, chunk):
+            stock_by_product = data_service.get_stock_data_bulk(org_id, chunk)
+            info_by_product = data_service.get_product_info_bulk(org_id, chunk)
+            results = _forecast_products(stock_by_product, info_by_product, org_id, engine)
+            
+            return [
+                _prediction_row(product_id, info_by_product[product_id], results[product_id])
+                for product_id in chunk if product_id in info_by_product
+            ]
+        
+        job = job_service.submit('forecast', org_id, product_ids, forecast_chunk, {'engine': engine})
+        
+        return jsonify({
+            'success': True,
+            'data': job
+        }), 202
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 @prediction_bp.route('/insights/stock-trends', methods=['POST'])
 def get_stock_trends():
     """Get stock trend insights for dashboard"""
@@ -129,49 +213,38 @@ def get_stock_trends():
                 'error': 'org_id is required'
             }), 400
         
+        # Serve the precomputed snapshot unless a live computation is requested
+        if not data.get('live'):
+            view = snapshot_service.view(org_id)
+            if view is not None:
+                return jsonify({
+                    'success': True,
+                    'data': view
+                })
+            
+            # First dashboard load for this org: answer live and build the snapshot
+            snapshot_service.request_refresh(org_id)
+        
         products = data_service.get_all_products_for_org(org_id)
         
-        trends = {
-            'critical_stock': [],  # < 7 days
-            'low_stock': [],       # 7-30 days
-            'healthy_stock': [],   # > 30 days
-            'no_data': []          # Insufficient data
-        }
+        trends = {bucket: [] for bucket in TREND_BUCKETS}
         
-        for product in products[:50]:  # Limit to 50 products
+        products = products[:50]  # Limit to 50 products
+        stock_by_product = data_service.get_stock_data_bulk(
+            org_id, [p['product_id'] for p in products]
+        )
+        
+        results = _forecast_products(
+            stock_by_product,
+            {product['product_id']: product for product in products},
+            org_id,
+            data.get('engine', 'batch')
+        )
+        
+        for product in products:
             try:
-                stock_data = data_service.get_stock_data(org_id, product['product_id'])
-                prediction = forecasting_service.predict_stock_depletion(stock_data, product)
-                
-                days_remaining = prediction.get('days_remaining')
-                
-                if days_remaining is None or not prediction.get('success'):
-                    trends['no_data'].append({
-                        'product_id': product['product_id'],
-                        'name': product['name'],
-                        'current_stock': product['current_stock']
-                    })
-                elif days_remaining < 7:
-                    trends['critical_stock'].append({
-                        'product_id': product['product_id'],
-                        'name': product['name'],
-                        'days_remaining': days_remaining,
-                        'current_stock': product['current_stock']
-                    })
-                elif days_remaining <= 30:
-                    trends['low_stock'].append({
-                        'product_id': product['product_id'],
-                        'name': product['name'],
-                        'days_remaining': days_remaining,
-                        'current_stock': product['current_stock']
-                    })
-                else:
-                    trends['healthy_stock'].append({
-                        'product_id': product['product_id'],
-                        'name': product['name'],
-                        'days_remaining': min(days_remaining, 90),  # Cap at 90 days
-                        'current_stock': product['current_stock']
-                    })
+                bucket, row = classify_depletion(product, results[product['product_id']])
+                trends[bucket].append(row)
                     
             except Exception as e:
                 print(f"Error analyzing product {product['product_id']}: {e}")
@@ -181,13 +254,9 @@ def get_stock_trends():
             'success': True,
             'data': {
                 'org_id': org_id,
-                'summary': {
-                    'critical_count': len(trends['critical_stock']),
-                    'low_count': len(trends['low_stock']),
-                    'healthy_count': len(trends['healthy_stock']),
-                    'no_data_count': len(trends['no_data'])
-                },
-                'trends': trends
+                'summary': summarize_trends(trends),
+                'trends': trends,
+                'snapshot': None
             }
         })
         
@@ -197,6 +266,64 @@ def get_stock_trends():
             'error': str(e)
         }), 500
 
+@prediction_bp.route('/insights/stock-trends/refresh', methods=['POST'])
+def refresh_stock_trends():
+    """Rebuild an org's stock trend snapshot now"""
+    try:
+        data = request.get_json()
+        org_id = data.get('org_id')
+        
+        if not org_id:
+            return jsonify({
+                'success': False,
+                'error': 'org_id is required'
+            }), 400
+        
+        snapshot_service.refresh(org_id, full=bool(data.get('full')))
+        
+        return jsonify({
+            'success': True,
+            'data': snapshot_service.view(org_id)
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@prediction_bp.route('/forecast/cache', methods=['GET'])
+def get_forecast_cache_stats():
+    """Fitted-model cache and ARIMA warm-start statistics"""
+    return jsonify({
+        'success': True,
+        'data': {
+            **forecasting_service.model_cache.stats(),
+            'arima': forecasting_service.arima_fit_stats()
+        }
+    })
+
+@prediction_bp.route('/forecast/cache/invalidate', methods=['POST'])
+def invalidate_forecast_cache():
+    """Drop cached forecasts for an org and/or product"""
+    try:
+        data = request.get_json(silent=True) or {}
+        removed = forecasting_service.invalidate_cache(
+            data.get('org_id'), data.get('product_id')
+        )
+        series_store.invalidate(data.get('org_id'), data.get('product_id'))
+        
+        return jsonify({
+            'success': True,
+            'data': {'removed': removed}
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 @prediction_bp.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
@@ -204,5 +331,6 @@ def health_check():
         'success': True,
         'service': 'AI Forecasting Service',
         'status': 'healthy',
-        'version': '1.0.0'
+        'version': '1.0.0',
+        'imports': import_report()
     })
\ No newline at end of file
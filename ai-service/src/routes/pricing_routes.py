@@ -1,11 +1,19 @@
 from flask import Blueprint, request, jsonify
+from datetime import datetime
+import numpy as np
 from ..services.pricing_service import PricingService, CompetitorScraper
+from ..services.bulk_pricing import BulkPricingEngine
+from ..services.elasticity_index import ElasticityIndex, interpret_elasticity
 from ..services.data_service import DataService
+from ..services.columnar import row_count
+from .job_routes import job_service
 
 pricing_bp = Blueprint('pricing', __name__)
-pricing_service = PricingService()
-competitor_scraper = CompetitorScraper()
 data_service = DataService()
+elasticity_index = ElasticityIndex(data_service)
+pricing_service = PricingService(elasticity_index)
+competitor_scraper = CompetitorScraper()
+bulk_pricing_engine = BulkPricingEngine(pricing_service, data_service)
 
 @pricing_bp.route('/pricing/optimize', methods=['POST'])
 def optimize_pricing():
@@ -31,7 +39,7 @@ def optimize_pricing():
             }), 404
         
         # Get sales history
-        sales_history = data_service.get_sales_history(org_id, product_id)
+        sales_history = data_service.get_sales_history(org_id, product_id, columnar=True)
         
         # Scrape competitor prices if requested
         competitor_prices = None
@@ -46,7 +54,7 @@ def optimize_pricing():
         
         # Calculate optimal pricing
         pricing_result = pricing_service.calculate_optimal_price(
-            product_info, sales_history, competitor_prices
+            product_info, sales_history, competitor_prices, org_id, product_id
         )
         
         return jsonify({
@@ -56,16 +64,33 @@ def optimize_pricing():
                 'product_name': product_info.get('name', ''),
                 'pricing': pricing_result,
                 'competitor_prices': competitor_prices or [],
-                'sales_data_points': len(sales_history)
+                'sales_data_points': row_count(sales_history)
             }
         })
-        
+    
     except Exception as e:
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
+def _pricing_row(product_id, product_info, pricing_result):
+    """Summary row for one product in bulk pricing results"""
+    return {
+        'product_id': product_id,
+        'product_name': product_info.get('name', ''),
+        'current_price': pricing_result.get('current_price', 0),
+        'recommended_price': pricing_result.get('recommended_price', 0),
+        'price_change': pricing_result.get('recommended_price', 0) - pricing_result.get('current_price', 0),
+        'price_change_percent': (
+            (pricing_result.get('recommended_price', 0) - pricing_result.get('current_price', 0)) / 
+            pricing_result['current_price'] * 100
+        ) if pricing_result.get('current_price') else 0,
+        'confidence': pricing_result.get('confidence', 0),
+        'method': pricing_result.get('method', 'unknown'),
+        'margin_percent': pricing_result.get('factors', {}).get('margin_percent', 0)
+    }
+
 @pricing_bp.route('/pricing/bulk-optimize', methods=['POST'])
 def bulk_optimize_pricing():
     """Optimize pricing for multiple products"""
@@ -86,42 +111,55 @@ def bulk_optimize_pricing():
             products = data_service.get_all_products_for_org(org_id)
             product_ids = [p['product_id'] for p in products]
         
+        engine = data.get('engine', 'global')
         pricing_results = []
         
-        for product_id in product_ids[:20]:  # Limit to 20 products
-            try:
-                product_info = data_service.get_product_info(org_id, product_id)
-                if not product_info:
-                    continue
-                
-                sales_history = data_service.get_sales_history(org_id, product_id)
-                
-                # Skip competitor scraping for bulk to avoid rate limits
-                competitor_prices = None
-                
-                pricing_result = pricing_service.calculate_optimal_price(
-                    product_info, sales_history, competitor_prices
-                )
+        if engine != 'global':
+            product_ids = product_ids[:20]  # Limit to 20 products when fitting per product
+        info_by_product = data_service.get_product_info_bulk(org_id, product_ids)
+        
+        # Scrape all products' competitors at once; sources are fetched
+        # concurrently under per-domain rate limits
+        competitor_by_product = {}
+        if include_competitors:
+            scraped_ids = [product_id for product_id in product_ids if product_id in info_by_product]
+            competitor_by_product = dict(zip(scraped_ids, competitor_scraper.scrape_many([
+                (info_by_product[product_id].get('name', ''), info_by_product[product_id].get('sku', ''))
+                for product_id in scraped_ids
+            ])))
+        
+        if engine == 'global':
+            # One demand model across the org's catalog and one scoring pass
+            model = bulk_pricing_engine.model_for_org(org_id, refresh=bool(data.get('refresh_model')))
+            results = bulk_pricing_engine.optimize(model, info_by_product)
+            
+            for product_id, pricing_result in results.items():
+                competitor_prices = competitor_by_product.get(product_id)
+                if competitor_prices:
+                    pricing_result['factors']['avg_competitor_price'] = np.mean([p['price'] for p in competitor_prices])
                 
                 if pricing_result.get('success'):
-                    pricing_results.append({
-                        'product_id': product_id,
-                        'product_name': product_info.get('name', ''),
-                        'current_price': pricing_result.get('current_price', 0),
-                        'recommended_price': pricing_result.get('recommended_price', 0),
-                        'price_change': pricing_result.get('recommended_price', 0) - pricing_result.get('current_price', 0),
-                        'price_change_percent': (
-                            (pricing_result.get('recommended_price', 0) - pricing_result.get('current_price', 0)) / 
-                            pricing_result.get('current_price', 1) * 100
-                        ),
-                        'confidence': pricing_result.get('confidence', 0),
-                        'method': pricing_result.get('method', 'unknown'),
-                        'margin_percent': pricing_result.get('factors', {}).get('margin_percent', 0)
-                    })
+                    pricing_results.append(_pricing_row(product_id, info_by_product[product_id], pricing_result))
+        else:
+            for product_id in product_ids:
+                try:
+                    product_info = info_by_product.get(product_id)
+                    if not product_info:
+                        continue
                     
-            except Exception as e:
-                print(f"Error optimizing pricing for product {product_id}: {e}")
-                continue
+                    sales_history = data_service.get_sales_history(org_id, product_id)
+                    competitor_prices = competitor_by_product.get(product_id)
+                    
+                    pricing_result = pricing_service.calculate_optimal_price(
+                        product_info, sales_history, competitor_prices, org_id, product_id
+                    )
+                    
+                    if pricing_result.get('success'):
+                        pricing_results.append(_pricing_row(product_id, product_info, pricing_result))
+                
+                except Exception as e:
+                    print(f"Error optimizing pricing for product {product_id}: {e}")
+                    continue
         
         # Sort by potential revenue impact
         pricing_results.sort(key=lambda x: abs(x['price_change']), reverse=True)
@@ -134,7 +172,107 @@ def bulk_optimize_pricing():
                 'pricing_results': pricing_results
             }
         })
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@pricing_bp.route('/pricing/simulate', methods=['POST'])
+def simulate_pricing():
+    """Project quantity, revenue and margin for a what-if price scenario"""
+    try:
+        data = request.get_json()
+        org_id = data.get('org_id')
+        changes = data.get('changes')
+        
+        if not org_id or not isinstance(changes, list) or not changes:
+            return jsonify({
+                'success': False,
+                'error': 'org_id and a list of changes are required'
+            }), 400
+        
+        # Scenarios reuse the org's cached demand model, nothing is refitted
+        model = bulk_pricing_engine.model_for_org(org_id, refresh=bool(data.get('refresh_model')))
         
+        try:
+            horizon_days = int(data.get('horizon_days', 30))
+            prices = bulk_pricing_engine.scenario_prices(model, changes)
+        except (TypeError, ValueError) as e:
+            return jsonify({
+                'success': False,
+                'error': f"Invalid price changes: {e}"
+            }), 400
+        
+        simulation = bulk_pricing_engine.simulate(
+            model, prices, horizon_days, include_products=bool(data.get('include_products', True))
+        )
+        
+        return jsonify({
+            'success': True,
+            'data': {
+                'org_id': org_id,
+                'model_fitted_at': model['fitted_at'].isoformat(),
+                **simulation
+            }
+        })
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@pricing_bp.route('/jobs/pricing', methods=['POST'])
+def submit_pricing_job():
+    """Queue a pricing optimization job covering all (or the given) products"""
+    try:
+        data = request.get_json()
+        org_id = data.get('org_id')
+        product_ids = data.get('product_ids', [])
+        
+        if not org_id:
+            return jsonify({
+                'success': False,
+                'error': 'org_id is required'
+            }), 400
+        
+        if not product_ids:
+            products = data_service.get_all_products_for_org(org_id)
+            product_ids = [p['product_id'] for p in products]
+        
+        def pricing_chunk(org_id, chunk):
+            info_by_product = data_service.get_product_info_bulk(org_id, chunk)
+            rows = []
+            
+            for product_id in chunk:
+                try:
+                    product_info = info_by_product.get(product_id)
+                    if not product_info:
+                        continue
+                    
+                    sales_history = data_service.get_sales_history(org_id, product_id, columnar=True)
+                    pricing_result = pricing_service.calculate_optimal_price(
+                        product_info, sales_history, org_id=org_id, product_id=product_id
+                    )
+                    
+                    if pricing_result.get('success'):
+                        rows.append(_pricing_row(product_id, product_info, pricing_result))
+                
+                except Exception as e:
+                    print(f"Error optimizing pricing for product {product_id}: {e}")
+                    continue
+            
+            return rows
+        
+        job = job_service.submit('pricing', org_id, product_ids, pricing_chunk)
+        
+        return jsonify({
+            'success': True,
+            'data': job
+        }), 202
+    
     except Exception as e:
         return jsonify({
             'success': False,
@@ -167,7 +305,7 @@ def get_competitor_prices():
                 'scraped_at': datetime.now().isoformat()
             }
         })
-        
+    
     except Exception as e:
         return jsonify({
             'success': False,
@@ -188,6 +326,21 @@ def calculate_elasticity():
                 'error': 'org_id and product_id are required'
             }), 400
         
+        # Serve the precomputed elasticity when the index covers the product
+        indexed = elasticity_index.get(org_id, product_id)
+        if indexed is not None and indexed['data_points'] >= 5:
+            return jsonify({
+                'success': True,
+                'data': {
+                    'product_id': product_id,
+                    'elasticity': round(indexed['elasticity'], 3),
+                    'interpretation': interpret_elasticity(indexed['elasticity']),
+                    'data_points': indexed['data_points'],
+                    'source': 'index',
+                    'updated_at': indexed['updated_at']
+                }
+            })
+        
         # Get sales history
         sales_history = data_service.get_sales_history(org_id, product_id)
         
@@ -200,24 +353,118 @@ def calculate_elasticity():
         # Calculate elasticity
         elasticity = pricing_service._calculate_demand_elasticity(sales_history)
         
-        # Interpret elasticity
-        if elasticity > -0.5:
-            interpretation = 'Inelastic - Price changes have minimal impact on demand'
-        elif elasticity > -1.5:
-            interpretation = 'Moderately elastic - Price changes moderately affect demand'
-        else:
-            interpretation = 'Highly elastic - Price changes significantly impact demand'
-        
         return jsonify({
             'success': True,
             'data': {
                 'product_id': product_id,
                 'elasticity': round(elasticity, 3),
-                'interpretation': interpretation,
-                'data_points': len(sales_history)
+                'interpretation': interpret_elasticity(elasticity),
+                'data_points': len(sales_history),
+                'source': 'live'
             }
         })
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@pricing_bp.route('/pricing/elasticity-index', methods=['GET'])
+def get_elasticity_index():
+    """Indexed elasticities of every product in an org, for dashboards"""
+    try:
+        org_id = request.args.get('org_id')
+        if not org_id:
+            return jsonify({
+                'success': False,
+                'error': 'org_id is required'
+            }), 400
         
+        table = elasticity_index.table(org_id)
+        if table is None:
+            return jsonify({
+                'success': False,
+                'error': 'Elasticity index is being built, retry shortly'
+            }), 503
+        
+        elasticities = np.array([row['elasticity'] for row in table['products']])
+        table['summary'] = {
+            'product_count': len(elasticities),
+            'median_elasticity': round(float(np.median(elasticities)), 3) if len(elasticities) else None,
+            'inelastic_count': int((elasticities > -0.5).sum()),
+            'moderate_count': int(((elasticities <= -0.5) & (elasticities > -1.5)).sum()),
+            'elastic_count': int((elasticities <= -1.5).sum())
+        }
+        
+        return jsonify({
+            'success': True,
+            'data': table
+        })
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@pricing_bp.route('/pricing/elasticity-index/refresh', methods=['POST'])
+def refresh_elasticity_index():
+    """Fold new sales into an org's elasticity index, or rebuild it"""
+    try:
+        data = request.get_json(silent=True) or {}
+        org_id = data.get('org_id')
+        if not org_id:
+            return jsonify({
+                'success': False,
+                'error': 'org_id is required'
+            }), 400
+        
+        index = elasticity_index.refresh(org_id, full=bool(data.get('full', False)))
+        if index is None:
+            return jsonify({
+                'success': False,
+                'error': 'Elasticity index requires MongoDB'
+            }), 503
+        
+        return jsonify({
+            'success': True,
+            'data': {
+                'org_id': org_id,
+                'product_count': len(index['rows']),
+                'refreshed_at': index['refreshed_at'].isoformat(),
+                'full_refreshed_at': index['full_refreshed_at'].isoformat()
+            }
+        })
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@pricing_bp.route('/pricing/models', methods=['GET'])
+def get_pricing_model_stats():
+    """Pricing model registry statistics"""
+    return jsonify({
+        'success': True,
+        'data': pricing_service.model_registry.stats()
+    })
+
+@pricing_bp.route('/pricing/models/invalidate', methods=['POST'])
+def invalidate_pricing_models():
+    """Drop trained pricing models for an org and/or product"""
+    try:
+        data = request.get_json(silent=True) or {}
+        removed = pricing_service.model_registry.invalidate(
+            data.get('org_id'), data.get('product_id')
+        )
+        
+        return jsonify({
+            'success': True,
+            'data': {'removed': removed}
+        })
+    
     except Exception as e:
         return jsonify({
             'success': False,
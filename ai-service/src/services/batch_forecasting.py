@@ -0,0 +1,232 @@
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+from .columnar import is_columnar
+
+class BatchForecaster:
+    """
+    Vectorized depletion forecasts for many products at once
+    
+    Daily balance series are aligned into a 2-D array (one row per product)
+    and fitted with damped-trend Holt exponential smoothing, updating every
+    row in a single NumPy pass per day. Products whose fit is noisy, or that
+    moved on fewer than min_data_points days, are flagged so callers can
+    escalate them to Prophet/ARIMA.
+    """
+    
+    def __init__(self, alpha=0.5, beta=0.2, phi=0.998, horizon=90,
+                 min_data_points=7, escalation_confidence=0.5):
+        self.alpha = alpha  # Level smoothing
+        self.beta = beta    # Trend smoothing
+        self.phi = phi      # Trend damping
+        self.horizon = horizon
+        self.min_data_points = min_data_points
+        self.escalation_confidence = escalation_confidence
+    
+    def align(self, stock_by_product, product_ids, days=90):
+        """
+        Align per-product stock movements into a daily balance matrix
+        
+        Args:
+            stock_by_product: Product ID to stock data (records or columnar)
+            product_ids: Row order of the matrix
+            days: Number of trailing days, one column per day
+        
+        Returns:
+            tuple: ((len(product_ids), days) balances, forward-filled and
+                NaN before a product's first movement; number of days each
+                product actually had movements on)
+        """
+        series = np.full((len(product_ids), days), np.nan)
+        start = np.datetime64(datetime.now().date(), 'D') - np.timedelta64(days - 1, 'D')
+        
+        rows, dates, balances = [], [], []
+        for row, product_id in enumerate(product_ids):
+            stock_data = stock_by_product.get(product_id)
+            if stock_data is None or len(stock_data) == 0:
+                continue
+            
+            if is_columnar(stock_data):
+                product_dates = stock_data['date']
+                product_balances = stock_data['balance']
+            else:
+                product_dates = [item['date'] for item in stock_data]
+                product_balances = [item['balance'] for item in stock_data]
+            
+            rows.append(np.full(len(product_balances), row))
+            dates.append(product_dates)
+            balances.append(np.asarray(product_balances, dtype='float64'))
+        
+        if not rows:
+            return series, np.zeros(len(product_ids), dtype=int)
+        
+        # Parse all dates in one call; columnar dates are already datetime64
+        rows = np.concatenate(rows)
+        dates = pd.to_datetime(np.concatenate(dates)).values
+        day_index = (dates.astype('datetime64[D]') - start).astype(int)
+        balances = np.concatenate(balances)
+        
+        # Sort by day so the last movement of each day wins on assignment
+        in_window = (day_index >= 0) & (day_index < days)
+        order = np.argsort(day_index[in_window], kind='stable')
+        series[rows[in_window][order], day_index[in_window][order]] = balances[in_window][order]
+        
+        # Forward-fill gaps along each row
+        observed = ~np.isnan(series)
+        movement_days = observed.sum(axis=1)
+        last_seen = np.where(observed, np.arange(days), 0)
+        np.maximum.accumulate(last_seen, axis=1, out=last_seen)
+        filled = series[np.arange(len(product_ids))[:, None], last_seen]
+        filled[~np.maximum.accumulate(observed, axis=1)] = np.nan
+        
+        return filled, movement_days
+    
+    def fit(self, series):
+        """
+        Fit damped-trend Holt smoothing to every row of a daily series matrix
+        
+        Returns:
+            dict: Per-row arrays of final level, trend, residual std and
+                number of non-NaN days (forward-filled days included)
+        """
+        n_rows, n_days = series.shape
+        level = np.full(n_rows, np.nan)
+        trend = np.zeros(n_rows)
+        count = np.zeros(n_rows, dtype=int)
+        sse = np.zeros(n_rows)
+        
+        for t in range(n_days):
+            x = series[:, t]
+            observed = ~np.isnan(x)
+            first = observed & (count == 0)
+            second = observed & (count == 1)
+            steady = observed & (count >= 2)
+            
+            predicted = level + self.phi * trend
+            error = np.where(steady, x - predicted, 0)
+            sse += error ** 2
+            
+            new_level = self.alpha * x + (1 - self.alpha) * predicted
+            new_trend = self.beta * (new_level - level) + (1 - self.beta) * self.phi * trend
+            level_next = np.where(steady, new_level, level)
+            trend = np.where(steady, new_trend, trend)
+            
+            # Initialise level from the first point and trend from the second
+            trend = np.where(second, x - level, trend)
+            level_next = np.where(second | first, x, level_next)
+            level = level_next
+            
+            count += observed
+        
+        residual_std = np.sqrt(sse / np.maximum(count - 2, 1))
+        return {'level': level, 'trend': trend, 'residual_std': residual_std, 'count': count}
+    
+    def forecast(self, series, current_stock, min_stock, movement_days=None):
+        """
+        Compute depletion days for every row at once
+        
+        Args:
+            series: (n_products, n_days) daily balance matrix
+            current_stock: Array of current stock per product
+            min_stock: Array of minimum stock per product
+            movement_days: Days each product actually moved on; defaults to
+                the non-NaN days of series
+        
+        Returns:
+            dict: Per-row arrays days_remaining (NaN if no depletion within
+                the horizon), trend, confidence and needs_escalation
+        """
+        current_stock = np.asarray(current_stock, dtype='float64')
+        min_stock = np.asarray(min_stock, dtype='float64')
+        fitted = self.fit(series)
+        trend = np.nan_to_num(fitted['trend'])
+        observed_days = fitted['count'] if movement_days is None else np.asarray(movement_days)
+        
+        # Cumulative damped trend over the horizon: phi + phi^2 + ... + phi^h
+        damping = np.cumsum(self.phi ** np.arange(1, self.horizon + 1))
+        projected = current_stock[:, None] + trend[:, None] * damping[None, :]
+        below_min = projected <= min_stock[:, None]
+        
+        days_remaining = np.where(below_min.any(axis=1), below_min.argmax(axis=1) + 1, np.nan)
+        days_remaining = np.where(current_stock <= min_stock, 0, days_remaining)
+        
+        # Noisy series relative to their trend get lower confidence
+        noise_ratio = fitted['residual_std'] / (np.abs(trend) + 1e-9)
+        confidence = np.clip(0.9 - 0.15 * np.log1p(noise_ratio), 0.3, 0.9)
+        
+        # Forward-filled days carry no information: a product that moved on
+        # only a few days gets the lowest confidence and is escalated
+        sparse = observed_days < self.min_data_points
+        confidence = np.where(sparse, 0.3, confidence)
+        confidence = np.where(observed_days < 2, 0, confidence)
+        
+        needs_escalation = (observed_days >= 2) & (sparse | (confidence < self.escalation_confidence))
+        
+        return {
+            'days_remaining': days_remaining,
+            'trend': trend,
+            'confidence': confidence,
+            'observed_days': observed_days,
+            'needs_escalation': needs_escalation
+        }
+    
+    def predict(self, stock_by_product, info_by_product, days=90):
+        """
+        Predict stock depletion for every product in info_by_product
+        
+        Returns:
+            dict: Product ID to a prediction dict shaped like
+                ForecastingService.predict_stock_depletion, plus a
+                needs_escalation flag
+        """
+        product_ids = list(info_by_product)
+        if not product_ids:
+            return {}
+        
+        series, movement_days = self.align(stock_by_product, product_ids, days)
+        result = self.forecast(
+            series,
+            [info_by_product[p].get('current_stock', 0) for p in product_ids],
+            [info_by_product[p].get('min_stock', 0) for p in product_ids],
+            movement_days
+        )
+        
+        now = datetime.now()
+        predictions = {}
+        for row, product_id in enumerate(product_ids):
+            observed_days = int(result['observed_days'][row])
+            if observed_days < 2:
+                predictions[product_id] = {
+                    'success': False,
+                    'error': 'Insufficient data for prediction',
+                    'depletion_date': None,
+                    'days_remaining': None,
+                    'confidence': 0,
+                    'needs_escalation': False
+                }
+                continue
+            
+            days_remaining = result['days_remaining'][row]
+            prediction = {
+                'success': True,
+                'confidence': round(float(result['confidence'][row]), 2),
+                'method': 'holt',
+                'avg_daily_consumption': round(float(-result['trend'][row]), 3),
+                'needs_escalation': bool(result['needs_escalation'][row])
+            }
+            
+            if np.isnan(days_remaining):
+                prediction.update({
+                    'depletion_date': None,
+                    'days_remaining': self.horizon,
+                    'message': f'No depletion expected in next {self.horizon} days'
+                })
+            else:
+                prediction.update({
+                    'depletion_date': (now + timedelta(days=float(days_remaining))).isoformat(),
+                    'days_remaining': int(days_remaining)
+                })
+            
+            predictions[product_id] = prediction
+        
+        return predictions
@@ -0,0 +1,346 @@
+import os
+import threading
+import numpy as np
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from .model_cache import ModelCache
+
+class BulkPricingEngine:
+    """
+    Catalog-wide price optimization with one shared demand model
+    
+    Every product gets a linear demand curve around its average price and
+    quantity, q = q_ref * (1 + slope * (p / p_ref - 1)), where slope is the
+    price elasticity at the average. Slopes come from a single least-squares
+    fit pooled over all sales lines: each product's own estimate is shrunk
+    towards its category's, and each category's towards the org-wide one,
+    so SKUs with few sales borrow strength from similar products. Price
+    grids for all products are then scored in vectorized chunks on a
+    thread pool, and what-if scenarios are evaluated against the same
+    curves.
+    """
+    
+    def __init__(self, pricing_service, data_service, history_days=90):
+        self.pricing_service = pricing_service
+        self.data_service = data_service
+        self.history_days = history_days
+        self.shrinkage = float(os.getenv('PRICING_SHRINKAGE', 0.5))
+        self.grid_chunk_size = int(os.getenv('PRICING_GRID_CHUNK', 2000))
+        self.max_workers = int(os.getenv('PRICING_WORKERS', os.cpu_count() or 1))
+        self.models = ModelCache(
+            max_size=int(os.getenv('DEMAND_MODEL_CACHE_SIZE', 64)),
+            ttl=int(os.getenv('DEMAND_MODEL_TTL', 3600))
+        )
+        self._fit_lock = threading.Lock()
+    
+    def model_for_org(self, org_id, refresh=False):
+        """
+        Get the org's demand model, fitting it over the whole catalog if needed
+        
+        Args:
+            org_id: Organization ID
+            refresh: Refit even if a cached model is still fresh
+        """
+        key = (org_id, None)
+        model = None if refresh else self.models.get(key)
+        if model is not None:
+            return model
+        
+        # One catalog-wide fit at a time; concurrent callers reuse its result
+        with self._fit_lock:
+            model = None if refresh else self.models.get(key)
+            if model is None:
+                product_ids = [p['product_id'] for p in self.data_service.get_all_products_for_org(org_id)]
+                info_by_product = self.data_service.get_product_info_bulk(org_id, product_ids)
+                sales_by_product = self.data_service.get_sales_history_bulk(
+                    org_id, list(info_by_product), self.history_days
+                )
+                
+                model = dict(self.fit(sales_by_product, info_by_product), history_days=self.history_days)
+                self.models.put(key, model)
+        
+        return model
+    
+    def fit(self, sales_by_product, info_by_product):
+        """
+        Fit the shared demand model
+        
+        Args:
+            sales_by_product: Product ID to columnar sales history
+            info_by_product: Product ID to product info
+        
+        Returns:
+            dict: Per-product arrays (ref_price, ref_quantity, slope,
+                weight, sales, last_price, current_price, cost_price)
+                aligned with product_ids, and index mapping product ID to row
+        """
+        product_ids = [p for p in info_by_product if len(sales_by_product.get(p, {}).get('quantity', ()))]
+        categories = [info_by_product[p].get('category') or '' for p in product_ids]
+        
+        # Flatten all sales lines with positive price and quantity
+        owner, prices, quantities = [], [], []
+        for index, product_id in enumerate(product_ids):
+            sales = sales_by_product[product_id]
+            valid = (sales['unit_price'] > 0) & (sales['quantity'] > 0)
+            owner.append(np.full(int(valid.sum()), index))
+            prices.append(sales['unit_price'][valid])
+            quantities.append(sales['quantity'][valid])
+        
+        size = len(product_ids)
+        owner = np.concatenate(owner) if owner else np.array([], dtype='int64')
+        prices = np.concatenate(prices) if prices else np.array([])
+        quantities = np.concatenate(quantities) if quantities else np.array([])
+        
+        counts = np.bincount(owner, minlength=size)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ref_price = np.bincount(owner, weights=prices, minlength=size) / counts
+            ref_quantity = np.bincount(owner, weights=quantities, minlength=size) / counts
+        
+        # Relative deviations from each product's average price and quantity
+        x = prices / ref_price[owner] - 1
+        y = quantities / ref_quantity[owner] - 1
+        sxx = np.bincount(owner, weights=x * x, minlength=size)
+        sxy = np.bincount(owner, weights=x * y, minlength=size)
+        
+        global_slope = sxy.sum() / sxx.sum() if sxx.sum() > 0 else -1.0
+        
+        _, category_index = np.unique(np.array(categories, dtype=object).astype(str), return_inverse=True)
+        category_sxx = np.bincount(category_index, weights=sxx)
+        category_sxy = np.bincount(category_index, weights=sxy)
+        category_slope = (category_sxy + self.shrinkage * global_slope) / (category_sxx + self.shrinkage)
+        
+        prior = category_slope[category_index] if size else np.array([])
+        slope = np.minimum((sxy + self.shrinkage * prior) / (sxx + self.shrinkage), 0)
+        
+        # Products without valid sales lines fall back to their listed price
+        no_lines = counts == 0
+        listed = np.array([info_by_product[p].get('current_price', 0) for p in product_ids], dtype='float64')
+        ref_price[no_lines] = listed[no_lines]
+        ref_quantity[no_lines] = 0
+        
+        last_price = np.array([sales_by_product[p]['unit_price'][-1] for p in product_ids], dtype='float64')
+        
+        return {
+            'product_ids': product_ids,
+            'index': {product_id: row for row, product_id in enumerate(product_ids)},
+            'last_price': last_price,
+            'current_price': np.where(listed > 0, listed, last_price),
+            'cost_price': np.array([info_by_product[p].get('cost_price', 0) for p in product_ids], dtype='float64'),
+            'categories': categories,
+            'ref_price': ref_price,
+            'ref_quantity': ref_quantity,
+            'slope': slope,
+            'weight': sxx / (sxx + self.shrinkage),
+            'sales': counts,
+            'global_slope': global_slope,
+            'fitted_at': datetime.now()
+        }
+    
+    def demand(self, model, prices, rows=slice(None)):
+        """Projected quantity at a matrix (or vector) of prices for model rows"""
+        ref_price = model['ref_price'][rows]
+        ref_quantity = model['ref_quantity'][rows]
+        slope = model['slope'][rows]
+        
+        if np.ndim(prices) == 2:
+            ref_price, ref_quantity, slope = ref_price[:, None], ref_quantity[:, None], slope[:, None]
+        
+        return np.maximum(0, ref_quantity * (1 + slope * (prices / ref_price - 1)))
+    
+    def optimize(self, model, info_by_product):
+        """
+        Recommend prices for products with a fitted demand model
+        
+        Args:
+            model: Demand model from fit() or model_for_org()
+            info_by_product: Product ID to product info for the products to price
+        
+        Returns:
+            dict: Product ID to pricing result
+        """
+        product_ids = [p for p in info_by_product if p in model['index']]
+        rows = np.array([model['index'][p] for p in product_ids], dtype='int64')
+        size = len(product_ids)
+        
+        # Listed price, or the last sale price for products without one
+        current_price = np.array([
+            info_by_product[p].get('current_price') or model['last_price'][row]
+            for p, row in zip(product_ids, rows)
+        ], dtype='float64')
+        bounds = np.array(
+            [self.pricing_service._price_bounds(info_by_product[p]) for p in product_ids], dtype='float64'
+        ).reshape(size, 2)
+        min_price, max_price = bounds[:, 0], bounds[:, 1]
+        
+        # Candidate window 80%-130% of the current price, inside the bounds
+        low = np.maximum(current_price * 0.8, min_price)
+        high = np.maximum(np.minimum(current_price * 1.3, max_price), low)
+        
+        best_price = np.empty(size)
+        chunks = [slice(start, min(start + self.grid_chunk_size, size)) for start in range(0, size, self.grid_chunk_size)]
+        
+        def score(chunk):
+            steps = np.linspace(0, 1, self.pricing_service.price_grid_points)
+            grid = low[chunk, None] + (high[chunk] - low[chunk])[:, None] * steps
+            revenue = grid * self.demand(model, grid, rows[chunk])
+            best = revenue.argmax(axis=1)
+            chosen = grid[np.arange(len(grid)), best]
+            best_price[chunk] = np.where(revenue.max(axis=1) > 0, chosen, current_price[chunk])
+        
+        if len(chunks) > 1 and self.max_workers > 1:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                list(executor.map(score, chunks))
+        else:
+            for chunk in chunks:
+                score(chunk)
+        
+        recommended = np.maximum(min_price, np.minimum(max_price, best_price))
+        results = {}
+        
+        for index, (product_id, row) in enumerate(zip(product_ids, rows)):
+            # Sales without a usable price and quantity carry no demand signal
+            if model['sales'][row] == 0:
+                continue
+            
+            cost_price = info_by_product[product_id].get('cost_price', 0)
+            price = float(recommended[index])
+            results[product_id] = {
+                'success': True,
+                'current_price': float(current_price[index]),
+                'recommended_price': round(price, 2),
+                'confidence': round(0.3 + 0.4 * float(model['weight'][row]), 2),
+                'method': 'global_demand',
+                'elasticity': round(float(model['slope'][row]), 2),
+                'factors': {
+                    'cost_price': cost_price,
+                    'margin_percent': ((price - cost_price) / price * 100) if price > 0 else 0,
+                    'sales_lines': int(model['sales'][row])
+                },
+                'price_bounds': {
+                    'min_price': round(float(min_price[index]), 2),
+                    'max_price': round(float(max_price[index]), 2)
+                }
+            }
+        
+        # Products without demand data get the simple pricing model
+        for product_id, product_info in info_by_product.items():
+            if product_id not in results:
+                results[product_id] = self.pricing_service._simple_pricing_model(product_info, [])
+        
+        return results
+    
+    def scenario_prices(self, model, changes):
+        """
+        Prices after applying a scenario's changes to the current prices
+        
+        Changes apply in order, so later ones override or compound earlier
+        ones. Each targets product_id, product_ids or category (every
+        product when none is given) and sets either an absolute price or a
+        percent change.
+        
+        Raises:
+            ValueError: If a change is not an object or has neither price
+                nor percent, or a price ends up negative
+        """
+        prices = model['current_price'].copy()
+        product_ids = np.array(model['product_ids'], dtype=object)
+        categories = np.array(model['categories'], dtype=object)
+        
+        for change in changes:
+            if not isinstance(change, dict):
+                raise ValueError('Each price change must be an object')
+            
+            if 'product_id' in change:
+                target = product_ids == change['product_id']
+            elif 'product_ids' in change:
+                target = np.isin(product_ids, np.array(change['product_ids'], dtype=object))
+            elif 'category' in change:
+                target = categories == change['category']
+            else:
+                target = np.ones(len(prices), dtype=bool)
+            
+            if change.get('price') is not None:
+                prices[target] = float(change['price'])
+            elif change.get('percent') is not None:
+                prices[target] *= 1 + float(change['percent']) / 100
+            else:
+                raise ValueError('Each price change needs a price or a percent')
+        
+        if (prices < 0).any():
+            raise ValueError('Price changes must not produce negative prices')
+        
+        return prices
+    
+    def simulate(self, model, prices, horizon_days=30, include_products=True):
+        """
+        Project quantity, revenue and margin at scenario prices
+        
+        Quantities are the demand per sale at each price times the product's
+        sales rate over the model's history, scaled to horizon_days.
+        
+        Args:
+            model: Demand model from model_for_org()
+            prices: Scenario price per model row, e.g. from scenario_prices()
+            horizon_days: Days to project over
+            include_products: Include per-product rows in the result
+        
+        Returns:
+            dict: Baseline and scenario totals over the changed products,
+                and per-product rows when requested
+        """
+        current_price = model['current_price']
+        changed = np.flatnonzero(~np.isclose(prices, current_price))
+        has_sales = model['sales'][changed] > 0
+        sales_per_horizon = model['sales'][changed] / model.get('history_days', self.history_days) * horizon_days
+        cost_price = model['cost_price'][changed]
+        
+        def project(price):
+            with np.errstate(invalid='ignore', divide='ignore'):
+                quantity = np.where(has_sales, self.demand(model, price, changed) * sales_per_horizon, 0)
+            return {
+                'quantity': quantity,
+                'revenue': price * quantity,
+                'margin': (price - cost_price) * quantity
+            }
+        
+        baseline = project(current_price[changed])
+        scenario = project(prices[changed])
+        
+        totals = {
+            name: {metric: round(float(values.sum()), 2) for metric, values in projection.items()}
+            for name, projection in (('baseline', baseline), ('scenario', scenario))
+        }
+        totals['change'] = {
+            metric: round(totals['scenario'][metric] - totals['baseline'][metric], 2)
+            for metric in baseline
+        }
+        
+        result = {
+            'horizon_days': horizon_days,
+            'changed_products': len(changed),
+            'summary': totals
+        }
+        
+        if include_products:
+            columns = {
+                'current_price': current_price[changed],
+                'scenario_price': prices[changed],
+                'elasticity': model['slope'][changed],
+                **{
+                    f'{name}_{metric}': values
+                    for name, projection in (('baseline', baseline), ('scenario', scenario))
+                    for metric, values in projection.items()
+                }
+            }
+            columns = {key: np.round(values, 2).tolist() for key, values in columns.items()}
+            
+            result['products'] = [
+                {
+                    'product_id': model['product_ids'][row],
+                    'category': model['categories'][row],
+                    **dict(zip(columns, values))
+                }
+                for row, values in zip(changed, zip(*columns.values()))
+            ]
+        
+        return result
@@ -0,0 +1,81 @@
+import numpy as np
+
+# Column layouts for the columnar DataService return format
+STOCK_COLUMNS = {
+    'date': 'datetime64[ns]',
+    'balance': 'float64',
+    'quantity': 'float64'
+}
+
+SALES_COLUMNS = {
+    'date': 'datetime64[ns]',
+    'quantity': 'float64',
+    'unit_price': 'float64',
+    'total_amount': 'float64',
+    'discount': 'float64'
+}
+
+def _to_datetime64(value):
+    """Convert a datetime or ISO-8601 string to numpy datetime64"""
+    if isinstance(value, str):
+        # numpy only accepts naive timestamps; backend dates are UTC
+        value = value.replace('Z', '').split('+')[0]
+    return np.datetime64(value, 'ns')
+
+def to_columns(records, columns, capacity=256):
+    """
+    Stream records into preallocated NumPy arrays
+    
+    Args:
+        records: Iterable of records (e.g. a pymongo cursor)
+        columns: Mapping of column name to (dtype, getter) where getter
+            extracts the column value from a record
+        capacity: Initial array length, doubled whenever it fills up
+    
+    Returns:
+        dict: Column name to NumPy array, all of equal length
+    """
+    arrays = {name: np.empty(capacity, dtype=dtype) for name, (dtype, _) in columns.items()}
+    size = 0
+    
+    for record in records:
+        if size == capacity:
+            capacity *= 2
+            for name, array in arrays.items():
+                grown = np.empty(capacity, dtype=array.dtype)
+                grown[:size] = array
+                arrays[name] = grown
+        
+        for name, (dtype, getter) in columns.items():
+            value = getter(record)
+            if dtype.startswith('datetime64'):
+                value = _to_datetime64(value)
+            arrays[name][size] = value if value is not None else 0
+        
+        size += 1
+    
+    return {name: array[:size] for name, array in arrays.items()}
+
+def records_to_columns(records, layout):
+    """Convert a list of record dicts to the columnar format"""
+    columns = {
+        name: (dtype, lambda record, name=name: record.get(name, 0))
+        for name, dtype in layout.items()
+    }
+    return to_columns(records, columns, capacity=max(len(records), 1))
+
+def is_columnar(data):
+    """Check whether data is in the columnar format"""
+    return isinstance(data, dict)
+
+def row_count(data):
+    """Number of rows in either a list of records or columnar data"""
+    if is_columnar(data):
+        return len(next(iter(data.values()))) if data else 0
+    return len(data)
+
+def column(data, name, default=0):
+    """Get one column as a float64 NumPy array from either format"""
+    if is_columnar(data):
+        return data[name]
+    return np.array([record.get(name, default) for record in data], dtype='float64')
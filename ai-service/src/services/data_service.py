@@ -1,64 +1,431 @@
 import os
+import re
+import atexit
+import threading
 import requests
-from pymongo import MongoClient
+import numpy as np
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from pymongo import MongoClient, ASCENDING, DESCENDING
 from datetime import datetime, timedelta
+from .columnar import STOCK_COLUMNS, SALES_COLUMNS, to_columns, records_to_columns
+
+# Process-wide MongoDB client. MongoClient owns its own connection pool and is
+# thread-safe, so every DataService in a worker shares this single instance.
+_mongo_client = None
+_mongo_client_pid = None
+_mongo_client_lock = threading.Lock()
+
+def get_mongo_client(mongo_uri):
+    """Get the shared pooled MongoClient, creating it on first use"""
+    global _mongo_client, _mongo_client_pid
+    
+    pid = os.getpid()
+    if _mongo_client is not None and _mongo_client_pid == pid:
+        return _mongo_client
+    
+    with _mongo_client_lock:
+        # A client inherited across fork() must not be reused by the child
+        if _mongo_client is None or _mongo_client_pid != pid:
+            _mongo_client = MongoClient(
+                mongo_uri,
+                maxPoolSize=int(os.getenv('MONGO_MAX_POOL_SIZE', 50)),
+                minPoolSize=int(os.getenv('MONGO_MIN_POOL_SIZE', 0)),
+                maxIdleTimeMS=int(os.getenv('MONGO_MAX_IDLE_TIME_MS', 60000)),
+                serverSelectionTimeoutMS=int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000)),
+                connect=False
+            )
+            _mongo_client_pid = pid
+    
+    return _mongo_client
+
+def close_mongo_client():
+    """Close the shared MongoClient owned by this process"""
+    global _mongo_client, _mongo_client_pid
+    
+    with _mongo_client_lock:
+        if _mongo_client is not None and _mongo_client_pid == os.getpid():
+            _mongo_client.close()
+        _mongo_client = None
+        _mongo_client_pid = None
+
+def _reset_mongo_client_after_fork():
+    """Drop the parent's client and lock in a freshly forked worker"""
+    global _mongo_client, _mongo_client_pid, _mongo_client_lock
+    _mongo_client = None
+    _mongo_client_pid = None
+    _mongo_client_lock = threading.Lock()
+
+atexit.register(close_mongo_client)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_mongo_client_after_fork)
+
+# Process-wide keep-alive session for the backend API fallback
+_http_session = None
+_http_session_pid = None
+_http_session_lock = threading.Lock()
+
+def get_http_session():
+    """Get the shared pooled requests.Session, creating it on first use"""
+    global _http_session, _http_session_pid
+    
+    pid = os.getpid()
+    if _http_session is not None and _http_session_pid == pid:
+        return _http_session
+    
+    with _http_session_lock:
+        if _http_session is None or _http_session_pid != pid:
+            retry = Retry(
+                total=int(os.getenv('BACKEND_MAX_RETRIES', 3)),
+                backoff_factor=float(os.getenv('BACKEND_RETRY_BACKOFF', 0.3)),
+                status_forcelist=[429, 500, 502, 503, 504],
+                allowed_methods=['GET']
+            )
+            pool_size = int(os.getenv('BACKEND_POOL_SIZE', 20))
+            adapter = HTTPAdapter(
+                pool_connections=pool_size,
+                pool_maxsize=pool_size,
+                max_retries=retry
+            )
+            
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            
+            _http_session = session
+            _http_session_pid = pid
+    
+    return _http_session
+
+def close_http_session():
+    """Close the shared requests.Session owned by this process"""
+    global _http_session, _http_session_pid
+    
+    with _http_session_lock:
+        if _http_session is not None and _http_session_pid == os.getpid():
+            _http_session.close()
+        _http_session = None
+        _http_session_pid = None
+
+def _reset_http_session_after_fork():
+    """Drop the parent's session and lock in a freshly forked worker"""
+    global _http_session, _http_session_pid, _http_session_lock
+    _http_session = None
+    _http_session_pid = None
+    _http_session_lock = threading.Lock()
+
+atexit.register(close_http_session)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_http_session_after_fork)
+
+# Compound indexes backing the AI service queries, per collection
+AI_SERVICE_INDEXES = {
+    'ledgers': [
+        [('orgID', ASCENDING), ('productID', ASCENDING), ('date', ASCENDING)],
+        [('orgID', ASCENDING), ('accountID', ASCENDING), ('date', DESCENDING)],
+        [('orgID', ASCENDING), ('createdAt', ASCENDING)]
+    ],
+    'accounts': [
+        [('orgID', ASCENDING), ('productID', ASCENDING)]
+    ],
+    'invoices': [
+        [('orgID', ASCENDING), ('items.productID', ASCENDING), ('createdAt', ASCENDING)]
+    ],
+    'products': [
+        [('orgID', ASCENDING), ('productID', ASCENDING)],
+        [('orgID', ASCENDING), ('status', ASCENDING)]
+    ],
+    'ai_elasticity_index': [
+        [('org_id', ASCENDING), ('product_id', ASCENDING)]
+    ],
+    'ai_jobs': [
+        [('job_id', ASCENDING)],
+        [('finished_at', ASCENDING)]
+    ],
+    'ai_job_results': [
+        [('job_id', ASCENDING), ('seq', ASCENDING)]
+    ]
+}
+
+def ensure_indexes(db):
+    """
+    Create the indexes used by the AI service queries (idempotent)
+    
+    Index builds can take long on large collections, so they run from
+    mongo_indexes.py at deploy time rather than on a request.
+    """
+    created = []
+    for collection, indexes in AI_SERVICE_INDEXES.items():
+        for keys in indexes:
+            created.append(db[collection].create_index(keys))
+    return created
+
+# Separators between the segments of a stock account ID, e.g. STOCK-P10
+ACCOUNT_ID_SEPARATOR = re.compile(r'[^0-9A-Za-z]+')
+
+def account_id_products(account_id, product_ids):
+    """
+    Product IDs an account ID names as whole segments
+    
+    STOCK-P10 names P10 but not P1; product IDs that themselves contain
+    separators (PROD-001) match when they span whole segments.
+    """
+    edges = [0]
+    for separator in ACCOUNT_ID_SEPARATOR.finditer(account_id):
+        edges.extend(separator.span())
+    edges.append(len(account_id))
+    starts, ends = edges[0::2], edges[1::2]
+    
+    return {
+        account_id[starts[i]:ends[j]]
+        for i in range(len(starts)) for j in range(i, len(ends))
+        if account_id[starts[i]:ends[j]] in product_ids
+    }
+
+# Column getters for streaming raw ledger documents into STOCK_COLUMNS
+LEDGER_COLUMN_GETTERS = {
+    'date': (STOCK_COLUMNS['date'], lambda item: item['date']),
+    'balance': (STOCK_COLUMNS['balance'], lambda item: item['balance']),
+    'quantity': (STOCK_COLUMNS['quantity'], lambda item: item.get('debit', 0) - item.get('credit', 0))
+}
+
+# Sales aggregation rows already carry the SALES_COLUMNS field names
+SALES_COLUMN_GETTERS = {
+    name: (dtype, lambda item, name=name: item[name])
+    for name, dtype in SALES_COLUMNS.items()
+}
 
 class DataService:
-    def __init__(self):
-        self.mongo_uri = os.getenv('MONGO_URI')
-        self.backend_url = os.getenv('BACKEND_URL', 'http://localhost:3001')
+    def __init__(self, mongo_uri=None, backend_url=None):
+        self.mongo_uri = mongo_uri or os.getenv('MONGO_URI')
+        self.backend_url = backend_url or os.getenv('BACKEND_URL', 'http://localhost:3001')
+        self.api_timeout = (
+            float(os.getenv('BACKEND_CONNECT_TIMEOUT', 3)),
+            float(os.getenv('BACKEND_READ_TIMEOUT', 10))
+        )
+        self.api_page_size = int(os.getenv('BACKEND_PAGE_SIZE', 200))
         self.client = None
-        
+        self.account_map_ttl = int(os.getenv('ACCOUNT_MAP_TTL', 300))
+        self._account_map = {}
+    
     def connect_db(self):
-        """Connect to MongoDB"""
+        """Get the setledger database from the shared MongoDB client"""
         if self.mongo_uri:
-            self.client = MongoClient(self.mongo_uri)
+            self.client = get_mongo_client(self.mongo_uri)
             return self.client.setledger
         return None
     
-    def get_stock_data(self, org_id, product_id, days=90):
-        """Get stock movement data for a product"""
+    def get_stock_data(self, org_id, product_id, days=90, columnar=False):
+        """
+        Get stock movement data for a product
+        
+        Args:
+            org_id: Organization ID
+            product_id: Product ID
+            days: Days of history to load
+            columnar: Return a dict of NumPy arrays (STOCK_COLUMNS) instead
+                of a list of dicts
+        """
         try:
             # Try MongoDB first
             db = self.connect_db()
-            if db:
+            if db is not None:
+                if columnar:
+                    cursor, _ = self._find_ledgers(db, org_id, [product_id], days)
+                    return to_columns(cursor, LEDGER_COLUMN_GETTERS)
                 return self._get_stock_from_mongo(db, org_id, product_id, days)
             
             # Fallback to API
-            return self._get_stock_from_api(org_id, product_id, days)
-            
+            stock_data = self._get_stock_from_api(org_id, product_id, days)
+            return records_to_columns(stock_data, STOCK_COLUMNS) if columnar else stock_data
+        
         except Exception as e:
             print(f"Error fetching stock data: {e}")
-            return []
+            return records_to_columns([], STOCK_COLUMNS) if columnar else []
+    
+    def get_stock_updates(self, org_id, product_id, since=None, days=90):
+        """
+        Get the stock movements recorded after a watermark
+        
+        Args:
+            org_id: Organization ID
+            product_id: Product ID
+            since: Ledger createdAt watermark; None loads the whole window
+            days: Days of history the window covers
+        
+        Returns:
+            tuple: (movements in the columnar format, new watermark), or
+                None when MongoDB is unavailable and nothing can be
+                loaded incrementally
+        """
+        db = self.connect_db()
+        if db is None:
+            return None
+        
+        loaded_at = datetime.now()
+        cursor, _ = self._find_ledgers(db, org_id, [product_id], days, created_after=since)
+        items = list(cursor)
+        
+        # Entries without createdAt cannot advance the watermark; fall back to
+        # the load time so the same window is not fetched again
+        created = [item['createdAt'] for item in items if item.get('createdAt') is not None]
+        watermark = max(created) if created else (since or loaded_at)
+        
+        return to_columns(items, LEDGER_COLUMN_GETTERS, capacity=max(len(items), 1)), watermark
     
     def get_product_info(self, org_id, product_id):
         """Get product information"""
         try:
             db = self.connect_db()
-            if db:
+            if db is not None:
                 return self._get_product_from_mongo(db, org_id, product_id)
             
             return self._get_product_from_api(org_id, product_id)
-            
+        
         except Exception as e:
             print(f"Error fetching product info: {e}")
             return {}
     
+    def get_stock_data_bulk(self, org_id, product_ids, days=90):
+        """Get stock movement data for many products, grouped by product ID"""
+        try:
+            db = self.connect_db()
+            if db is not None:
+                return self._get_stock_bulk_from_mongo(db, org_id, product_ids, days)
+            
+            # The backend API has no batch endpoint, fetch one product at a time
+            return {
+                product_id: self._get_stock_from_api(org_id, product_id, days)
+                for product_id in product_ids
+            }
+        
+        except Exception as e:
+            print(f"Error fetching bulk stock data: {e}")
+            return {product_id: [] for product_id in product_ids}
+    
+    def get_product_info_bulk(self, org_id, product_ids):
+        """Get product information for many products, keyed by product ID"""
+        try:
+            db = self.connect_db()
+            if db is not None:
+                return self._get_products_bulk_from_mongo(db, org_id, product_ids)
+            
+            products = {}
+            for product_id in product_ids:
+                product = self._get_product_from_api(org_id, product_id)
+                if product:
+                    products[product_id] = product
+            return products
+        
+        except Exception as e:
+            print(f"Error fetching bulk product info: {e}")
+            return {}
+    
     def _get_stock_from_mongo(self, db, org_id, product_id, days):
         """Get stock data from MongoDB"""
+        return self._get_stock_bulk_from_mongo(db, org_id, [product_id], days)[product_id]
+    
+    def _get_stock_bulk_from_mongo(self, db, org_id, product_ids, days):
+        """Get stock data for many products from MongoDB in one query"""
+        grouped = {product_id: [] for product_id in product_ids}
+        
+        if not product_ids:
+            return grouped
+        
+        cursor, account_owners = self._find_ledgers(db, org_id, product_ids, days)
+        
+        for item in cursor:
+            entry = self._format_ledger_entry(item)
+            if item.get('productID') in grouped:
+                grouped[item['productID']].append(entry)
+            else:
+                for product_id in account_owners.get(item.get('accountID'), []):
+                    grouped[product_id].append(entry)
+        
+        return grouped
+    
+    def _find_ledgers(self, db, org_id, product_ids, days, created_after=None):
+        """Open a date-sorted ledger cursor for products, with the account-to-product map"""
         cutoff_date = datetime.now() - timedelta(days=days)
         
-        stock_data = list(db.ledgers.find({
+        # Ledgers either carry a productID or post to a product's stock account;
+        # both branches are exact matches served by (orgID, ..., date) indexes
+        account_map = self._resolve_product_accounts(db, org_id, product_ids)
+        account_owners = {}
+        for product_id, account_ids in account_map.items():
+            for account_id in account_ids:
+                account_owners.setdefault(account_id, []).append(product_id)
+        
+        product_filters = [{'productID': {'$in': list(product_ids)}}]
+        if account_owners:
+            product_filters.append({'accountID': {'$in': list(account_owners)}})
+        
+        query = {
             'orgID': org_id,
-            'accountID': {'$regex': f'.*{product_id}.*'},
+            '$or': product_filters,
             'date': {'$gte': cutoff_date}
-        }).sort('date', 1))
+        }
+        if created_after is not None:
+            query['createdAt'] = {'$gt': created_after}
         
-        return [{
+        cursor = db.ledgers.find(query, {
+            'productID': 1,
+            'accountID': 1,
+            'date': 1,
+            'balance': 1,
+            'debit': 1,
+            'credit': 1,
+            'createdAt': 1
+        }).sort('date', 1)
+        
+        return cursor, account_owners
+    
+    def _resolve_product_accounts(self, db, org_id, product_ids):
+        """Map product IDs to their stock account IDs, cached per org and product"""
+        now = datetime.now()
+        account_map = {}
+        missing = []
+        
+        for product_id in product_ids:
+            cached = self._account_map.get((org_id, product_id))
+            if cached and cached[0] > now:
+                account_map[product_id] = cached[1]
+            else:
+                missing.append(product_id)
+        
+        if not missing:
+            return account_map
+        
+        # The chart of accounts is small per org, so it is matched here rather
+        # than through one $regex alternation, which outgrows MongoDB's pattern
+        # limit on large catalogs
+        wanted = set(missing)
+        resolved = {product_id: [] for product_id in missing}
+        for account in db.accounts.find({'orgID': org_id}, {'_id': 0, 'accountID': 1, 'productID': 1}):
+            account_id = account.get('accountID')
+            if not account_id:
+                continue
+            
+            owners = account_id_products(account_id, wanted)
+            if account.get('productID') in wanted:
+                owners.add(account['productID'])
+            for product_id in owners:
+                resolved[product_id].append(account_id)
+        
+        expires_at = now + timedelta(seconds=self.account_map_ttl)
+        for product_id, account_ids in resolved.items():
+            self._account_map[(org_id, product_id)] = (expires_at, account_ids)
+            account_map[product_id] = account_ids
+        
+        return account_map
+    
+    def _format_ledger_entry(self, item):
+        """Convert a ledger document to a stock movement record"""
+        return {
             'date': item['date'],
             'balance': item['balance'],
             'quantity': item.get('debit', 0) - item.get('credit', 0)
-        } for item in stock_data]
+        }
     
     def _get_product_from_mongo(self, db, org_id, product_id):
         """Get product info from MongoDB"""
@@ -68,33 +435,83 @@ class DataService:
         })
         
         if product:
-            return {
-                'current_stock': product.get('inventory', {}).get('currentStock', 0),
-                'min_stock': product.get('inventory', {}).get('minStock', 0),
-                'name': product.get('name', ''),
-                'sku': product.get('sku', '')
-            }
+            return self._format_product(product)
         
         return {}
     
-    def _get_stock_from_api(self, org_id, product_id, days):
-        """Get stock data from API (fallback)"""
-        try:
-            response = requests.get(
-                f"{self.backend_url}/api/v1/stock/movements",
-                params={'productID': product_id, 'limit': days * 2},
-                timeout=10
+    def _get_products_bulk_from_mongo(self, db, org_id, product_ids):
+        """Get product info for many products from MongoDB in one query"""
+        if not product_ids:
+            return {}
+        
+        products = db.products.find({
+            'orgID': org_id,
+            'productID': {'$in': list(product_ids)}
+        })
+        
+        return {p['productID']: self._format_product(p) for p in products}
+    
+    def _format_product(self, product):
+        """Convert a product document to the product info used for forecasting and pricing"""
+        return {
+            'current_stock': product.get('inventory', {}).get('currentStock', 0),
+            'min_stock': product.get('inventory', {}).get('minStock', 0),
+            'name': product.get('name', ''),
+            'sku': product.get('sku', ''),
+            'category': product.get('category', ''),
+            'current_price': product.get('pricing', {}).get('sellingPrice', 0),
+            'cost_price': product.get('pricing', {}).get('costPrice', 0)
+        }
+    
+    def iter_api_pages(self, path, params=None):
+        """
+        Stream items from a paginated backend endpoint
+        
+        Pages are requested one at a time over the shared keep-alive session
+        until the backend returns a short page or reports no more pages.
+        
+        Args:
+            path: API path, e.g. /api/v1/invoices
+            params: Query parameters sent with every page
+        
+        Yields:
+            dict: Items from each page's data array
+        """
+        session = get_http_session()
+        page = 1
+        
+        while True:
+            response = session.get(
+                f"{self.backend_url}{path}",
+                params={**(params or {}), 'page': page, 'limit': self.api_page_size},
+                timeout=self.api_timeout
             )
+            response.raise_for_status()
             
-            if response.status_code == 200:
-                data = response.json()
-                if data.get('success'):
-                    return [{
-                        'date': item['date'],
-                        'balance': item['balanceAfter'],
-                        'quantity': item['quantity']
-                    } for item in data.get('data', [])]
+            data = response.json()
+            if not data.get('success'):
+                raise ValueError(f"Backend request to {path} failed: {data.get('message', 'unknown error')}")
+            
+            items = data.get('data', [])
+            yield from items
             
+            total_pages = data.get('pagination', {}).get('pages')
+            if len(items) < self.api_page_size or (total_pages is not None and page >= total_pages):
+                return
+            page += 1
+    
+    def _get_stock_from_api(self, org_id, product_id, days):
+        """Get stock data from API (fallback)"""
+        try:
+            return [{
+                'date': item['date'],
+                'balance': item['balanceAfter'],
+                'quantity': item['quantity']
+            } for item in self.iter_api_pages(
+                '/api/v1/stock/movements',
+                {'productID': product_id, 'days': days}
+            )]
+        
         except Exception as e:
             print(f"API request failed: {e}")
         
@@ -103,22 +520,16 @@ class DataService:
     def _get_product_from_api(self, org_id, product_id):
         """Get product info from API (fallback)"""
         try:
-            response = requests.get(
+            response = get_http_session().get(
                 f"{self.backend_url}/api/v1/products/{product_id}",
-                timeout=10
+                timeout=self.api_timeout
             )
             
             if response.status_code == 200:
                 data = response.json()
                 if data.get('success'):
-                    product = data.get('data', {})
-                    return {
-                        'current_stock': product.get('inventory', {}).get('currentStock', 0),
-                        'min_stock': product.get('inventory', {}).get('minStock', 0),
-                        'name': product.get('name', ''),
-                        'sku': product.get('sku', '')
-                    }
-            
+                    return self._format_product(data.get('data', {}))
+        
         except Exception as e:
             print(f"API request failed: {e}")
         
@@ -128,7 +539,7 @@ class DataService:
         """Get all products for an organization"""
         try:
             db = self.connect_db()
-            if db:
+            if db is not None:
                 products = list(db.products.find({
                     'orgID': org_id,
                     'status': 'active'
@@ -147,76 +558,211 @@ class DataService:
                     'current_stock': p.get('inventory', {}).get('currentStock', 0),
                     'min_stock': p.get('inventory', {}).get('minStock', 0)
                 } for p in products]
-            
+        
         except Exception as e:
             print(f"Error fetching products: {e}")
         
         return []
     
-    def get_sales_history(self, org_id, product_id, days=90):
-        """Get sales history for pricing analysis"""
+    def get_active_org_ids(self):
+        """Get the IDs of all organizations with active products"""
         try:
             db = self.connect_db()
-            if db:
-                return self._get_sales_from_mongo(db, org_id, product_id, days)
+            if db is not None:
+                return db.products.distinct('orgID', {'status': 'active'})
+        
+        except Exception as e:
+            print(f"Error fetching organizations: {e}")
+        
+        return []
+    
+    def get_changed_product_ids(self, org_id, product_ids, since):
+        """
+        Get the products whose ledgers received entries after a point in time
+        
+        Args:
+            org_id: Organization ID
+            product_ids: Product IDs to check
+            since: Only ledger entries created after this datetime count
+        
+        Returns:
+            set: Changed product IDs; without MongoDB every product is
+                reported as changed
+        """
+        try:
+            db = self.connect_db()
+            if db is None:
+                return set(product_ids)
+            
+            account_map = self._resolve_product_accounts(db, org_id, product_ids)
+            query = {'orgID': org_id, 'createdAt': {'$gt': since}}
+            
+            changed_products = set(db.ledgers.distinct('productID', query))
+            changed_accounts = set(db.ledgers.distinct('accountID', query))
             
-            return self._get_sales_from_api(org_id, product_id, days)
+            return {
+                product_id for product_id in product_ids
+                if product_id in changed_products
+                or changed_accounts.intersection(account_map.get(product_id, []))
+            }
+        
+        except Exception as e:
+            print(f"Error checking ledger changes: {e}")
+            return set(product_ids)
+    
+    def get_sales_history(self, org_id, product_id, days=90, columnar=False):
+        """
+        Get sales history for pricing analysis
+        
+        Args:
+            org_id: Organization ID
+            product_id: Product ID
+            days: Days of history to load
+            columnar: Return a dict of NumPy arrays (SALES_COLUMNS) instead
+                of a list of dicts
+        """
+        try:
+            db = self.connect_db()
+            if db is not None:
+                if columnar:
+                    cursor = db.invoices.aggregate(self._sales_pipeline(org_id, product_id, days))
+                    return to_columns(cursor, SALES_COLUMN_GETTERS)
+                return self._get_sales_from_mongo(db, org_id, product_id, days)
             
+            sales_data = self._get_sales_from_api(org_id, product_id, days)
+            return records_to_columns(sales_data, SALES_COLUMNS) if columnar else sales_data
+        
         except Exception as e:
             print(f"Error fetching sales data: {e}")
-            return []
+            return records_to_columns([], SALES_COLUMNS) if columnar else []
+    
+    def get_sales_history_bulk(self, org_id, product_ids, days=90):
+        """
+        Get sales history for many products in the columnar format
+        
+        Returns:
+            dict: Product ID to SALES_COLUMNS arrays, empty for products
+                without sales
+        """
+        try:
+            db = self.connect_db()
+            if db is not None:
+                return self._get_sales_bulk_from_mongo(db, org_id, product_ids, days)
+            
+            # The backend API has no batch endpoint, fetch one product at a time
+            return {
+                product_id: records_to_columns(self._get_sales_from_api(org_id, product_id, days), SALES_COLUMNS)
+                for product_id in product_ids
+            }
+        
+        except Exception as e:
+            print(f"Error fetching bulk sales data: {e}")
+            return {product_id: records_to_columns([], SALES_COLUMNS) for product_id in product_ids}
+    
+    def _get_sales_bulk_from_mongo(self, db, org_id, product_ids, days):
+        """Get sales lines for many products from MongoDB in one aggregation"""
+        sales = self._aggregate_sales_lines(db, self._sales_pipeline(org_id, {'$in': list(product_ids)}, days))
+        
+        # Group rows by product, keeping each product's rows in date order
+        owners = sales.pop('product_id')
+        order = np.argsort(owners.astype(str), kind='stable')
+        grouped = {product_id: records_to_columns([], SALES_COLUMNS) for product_id in product_ids}
+        
+        if len(order):
+            sorted_owners = owners[order]
+            starts = np.flatnonzero(np.r_[True, sorted_owners[1:] != sorted_owners[:-1]])
+            for start, end in zip(starts, np.r_[starts[1:], len(order)]):
+                rows = order[start:end]
+                grouped[sorted_owners[start]] = {name: values[rows] for name, values in sales.items()}
+        
+        return grouped
+    
+    def get_sales_lines(self, org_id, since=None, days=365):
+        """
+        Get every product's sales lines for an org, optionally only new ones
+        
+        Args:
+            org_id: Organization ID
+            since: Only invoices created after this datetime
+            days: Days of history to load
+        
+        Returns:
+            dict: SALES_COLUMNS arrays plus a product_id column, in date
+                order, or None when MongoDB is unavailable
+        """
+        db = self.connect_db()
+        if db is None:
+            return None
+        
+        pipeline = self._sales_pipeline(org_id, {'$exists': True}, days)
+        if since is not None:
+            pipeline[0]['$match']['createdAt']['$gt'] = since
+        
+        return self._aggregate_sales_lines(db, pipeline)
+    
+    def _aggregate_sales_lines(self, db, pipeline):
+        """Run a sales pipeline into columns, tagging each line with its product"""
+        pipeline[-1]['$project']['product_id'] = '$items.productID'
+        getters = dict(SALES_COLUMN_GETTERS, product_id=('object', lambda item: item['product_id']))
+        return to_columns(db.invoices.aggregate(pipeline), getters)
     
     def _get_sales_from_mongo(self, db, org_id, product_id, days):
         """Get sales data from MongoDB"""
+        return list(db.invoices.aggregate(self._sales_pipeline(org_id, product_id, days)))
+    
+    def _sales_pipeline(self, org_id, product_id, days):
+        """
+        Aggregation pipeline returning one row per matching invoice line
+        
+        product_id may also be a query operator such as {'$in': [...]}.
+        """
         cutoff_date = datetime.now() - timedelta(days=days)
         
-        # Get invoice items for this product
-        invoices = list(db.invoices.find({
-            'orgID': org_id,
-            'createdAt': {'$gte': cutoff_date},
-            'items.productID': product_id
-        }).sort('createdAt', 1))
-        
-        sales_data = []
-        for invoice in invoices:
-            for item in invoice.get('items', []):
-                if item.get('productID') == product_id:
-                    sales_data.append({
-                        'date': invoice['createdAt'],
-                        'quantity': item.get('quantity', 0),
-                        'unit_price': item.get('unitPrice', 0),
-                        'total_amount': item.get('totalAmount', 0),
-                        'discount': item.get('discount', 0)
-                    })
-        
-        return sales_data
+        # Unwind on the server so only the matching line items cross the wire
+        return [
+            {'$match': {
+                'orgID': org_id,
+                'items.productID': product_id,
+                'createdAt': {'$gte': cutoff_date}
+            }},
+            {'$sort': {'createdAt': 1}},
+            {'$project': {'_id': 0, 'createdAt': 1, 'items': 1}},
+            {'$unwind': '$items'},
+            {'$match': {'items.productID': product_id}},
+            {'$project': {
+                'date': '$createdAt',
+                'quantity': {'$ifNull': ['$items.quantity', 0]},
+                'unit_price': {'$ifNull': ['$items.unitPrice', 0]},
+                'total_amount': {'$ifNull': ['$items.totalAmount', 0]},
+                'discount': {'$ifNull': ['$items.discount', 0]}
+            }}
+        ]
     
     def _get_sales_from_api(self, org_id, product_id, days):
         """Get sales data from API (fallback)"""
         try:
-            response = requests.get(
-                f"{self.backend_url}/api/v1/invoices",
-                params={'productID': product_id, 'days': days},
-                timeout=10
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                if data.get('success'):
-                    sales_data = []
-                    for invoice in data.get('data', []):
-                        for item in invoice.get('items', []):
-                            if item.get('productID') == product_id:
-                                sales_data.append({
-                                    'date': invoice['createdAt'],
-                                    'quantity': item.get('quantity', 0),
-                                    'unit_price': item.get('unitPrice', 0),
-                                    'total_amount': item.get('totalAmount', 0),
-                                    'discount': item.get('discount', 0)
-                                })
-                    return sales_data
+            # The backend filters invoices by product and trims them to the
+            # line item fields listed here
+            invoices = self.iter_api_pages('/api/v1/invoices', {
+                'productID': product_id,
+                'days': days,
+                'fields': 'createdAt,items.productID,items.quantity,items.unitPrice,items.totalAmount,items.discount'
+            })
             
+            sales_data = []
+            for invoice in invoices:
+                for item in invoice.get('items', []):
+                    if item.get('productID') == product_id:
+                        sales_data.append({
+                            'date': invoice['createdAt'],
+                            'quantity': item.get('quantity', 0),
+                            'unit_price': item.get('unitPrice', 0),
+                            'total_amount': item.get('totalAmount', 0),
+                            'discount': item.get('discount', 0)
+                        })
+            return sales_data
+        
         except Exception as e:
             print(f"API request failed: {e}")
         
-        return []
\ No newline at end of file
+        return []
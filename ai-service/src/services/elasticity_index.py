@@ -0,0 +1,258 @@
+import os
+import threading
+import numpy as np
+from datetime import datetime, timedelta
+from pymongo import UpdateOne
+
+# Per-product sufficient statistics of the log-log demand regression
+STAT_FIELDS = ('n', 'sum_log_price', 'sum_log_quantity', 'sum_log_price_sq', 'sum_log_price_quantity')
+
+def interpret_elasticity(elasticity):
+    """Describe how strongly demand reacts to price"""
+    if elasticity > -0.5:
+        return 'Inelastic - Price changes have minimal impact on demand'
+    elif elasticity > -1.5:
+        return 'Moderately elastic - Price changes moderately affect demand'
+    return 'Highly elastic - Price changes significantly impact demand'
+
+def elasticities_from_stats(stats, min_points=3):
+    """
+    Log-log regression slope per row of a statistics matrix
+    
+    Rows with fewer than min_points sales or no price variation get the
+    default elasticity of -1.0; slopes are clamped to [-5, 0].
+    """
+    n, sx, sy, sxx, sxy = stats.T
+    with np.errstate(invalid='ignore', divide='ignore'):
+        variance = sxx - sx * sx / n
+        slope = (sxy - sx * sy / n) / variance
+    
+    usable = (n >= min_points) & (variance > 1e-12)
+    return np.clip(np.where(usable, slope, -1.0), -5.0, 0)
+
+class ElasticityIndex:
+    """
+    Price elasticity of every product in an org, kept ready to read
+    
+    Elasticity is the slope of log(quantity) on log(price) over a product's
+    sales lines. The index stores each product's regression sums, so a
+    refresh only aggregates invoices created after its watermark and adds
+    them in; a full rebuild every ELASTICITY_FULL_REFRESH seconds drops
+    sales that have left the ELASTICITY_DAYS window. Indexes are kept in
+    memory and in MongoDB; reads of a stale index trigger a background
+    refresh and answer from the current one.
+    """
+    
+    def __init__(self, data_service):
+        self.data_service = data_service
+        self.days = int(os.getenv('ELASTICITY_DAYS', 365))
+        self.refresh_interval = int(os.getenv('ELASTICITY_REFRESH_INTERVAL', 900))
+        self.full_refresh = int(os.getenv('ELASTICITY_FULL_REFRESH', 604800))
+        self.min_points = 3  # Sales lines below which elasticity is the default
+        self._indexes = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+    
+    def get(self, org_id, product_id):
+        """
+        Indexed elasticity for one product
+        
+        Returns:
+            dict: elasticity, data_points and updated_at, or None if the
+                product is not indexed
+        """
+        index = self._current(org_id)
+        if index is None or product_id not in index['rows']:
+            return None
+        
+        row = index['rows'][product_id]
+        return {
+            'elasticity': float(index['elasticity'][row]),
+            'data_points': int(index['stats'][row, 0]),
+            'updated_at': index['refreshed_at'].isoformat()
+        }
+    
+    def table(self, org_id):
+        """All indexed products of an org with their elasticities, or None"""
+        index = self._current(org_id)
+        if index is None:
+            return None
+        
+        return {
+            'org_id': org_id,
+            'refreshed_at': index['refreshed_at'].isoformat(),
+            'age_seconds': round((datetime.now() - index['refreshed_at']).total_seconds(), 1),
+            'products': [
+                {
+                    'product_id': product_id,
+                    'elasticity': round(float(index['elasticity'][row]), 3),
+                    'data_points': int(index['stats'][row, 0])
+                }
+                for product_id, row in index['rows'].items()
+            ]
+        }
+    
+    def refresh(self, org_id, full=False):
+        """
+        Fold sales created since the last refresh into an org's index
+        
+        Args:
+            org_id: Organization ID
+            full: Rebuild from the whole ELASTICITY_DAYS window
+        
+        Returns:
+            dict: The refreshed index, or the previous one when MongoDB is
+                unavailable
+        """
+        started_at = datetime.now()
+        previous = self._current(org_id, refresh_stale=False)
+        full = (
+            full or previous is None
+            or started_at - previous['full_refreshed_at'] > timedelta(seconds=self.full_refresh)
+        )
+        
+        lines = self.data_service.get_sales_lines(org_id, None if full else previous['watermark'], self.days)
+        if lines is None:
+            return previous
+        
+        if full:
+            rows, stats = {}, np.zeros((0, len(STAT_FIELDS)))
+        else:
+            rows, stats = dict(previous['rows']), previous['stats'].copy()
+        
+        # Regression sums of the new lines, grouped by product
+        valid = (lines['unit_price'] > 0) & (lines['quantity'] > 0)
+        products, owner = np.unique(lines['product_id'][valid].astype(str), return_inverse=True)
+        log_price = np.log(lines['unit_price'][valid])
+        log_quantity = np.log(lines['quantity'][valid])
+        new_stats = np.column_stack([
+            np.bincount(owner, weights=weights, minlength=len(products))
+            for weights in (np.ones(len(owner)), log_price, log_quantity, log_price ** 2, log_price * log_quantity)
+        ]) if len(products) else np.zeros((0, len(STAT_FIELDS)))
+        
+        for product_id in products:
+            if product_id not in rows:
+                rows[product_id] = len(rows)
+        if len(rows) > len(stats):
+            stats = np.vstack([stats, np.zeros((len(rows) - len(stats), len(STAT_FIELDS)))])
+        
+        changed = np.array([rows[product_id] for product_id in products], dtype='int64')
+        stats[changed] += new_stats
+        
+        if len(lines['date']):
+            watermark = lines['date'].max().astype('datetime64[ms]').item()
+        else:
+            watermark = None if full else previous['watermark']
+        
+        index = {
+            'org_id': org_id,
+            'rows': rows,
+            'stats': stats,
+            'elasticity': elasticities_from_stats(stats, self.min_points),
+            'watermark': watermark,
+            'refreshed_at': started_at,
+            'full_refreshed_at': started_at if full else previous['full_refreshed_at']
+        }
+        
+        with self._lock:
+            self._indexes[org_id] = index
+        self._save(index, list(products), full)
+        
+        return index
+    
+    def _current(self, org_id, refresh_stale=True):
+        """The org's index from memory or MongoDB, scheduling a refresh if stale"""
+        with self._lock:
+            index = self._indexes.get(org_id)
+        
+        if index is None:
+            index = self._load(org_id)
+            if index is not None:
+                with self._lock:
+                    self._indexes[org_id] = index
+        
+        if refresh_stale and (index is None or (datetime.now() - index['refreshed_at']).total_seconds() > self.refresh_interval):
+            self._refresh_in_background(org_id)
+        
+        return index
+    
+    def _refresh_in_background(self, org_id):
+        """Refresh an org's index on a one-off thread unless one is running"""
+        with self._lock:
+            if org_id in self._refreshing:
+                return
+            self._refreshing.add(org_id)
+        
+        def run():
+            try:
+                self.refresh(org_id)
+            except Exception as e:
+                print(f"Elasticity refresh failed for {org_id}: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(org_id)
+        
+        threading.Thread(target=run, daemon=True).start()
+    
+    def _save(self, index, changed_products, full):
+        """Persist changed products and the watermark to MongoDB, if available"""
+        try:
+            db = self.data_service.connect_db()
+            if db is None:
+                return
+            
+            org_id = index['org_id']
+            if full:
+                db.ai_elasticity_index.delete_many({'org_id': org_id})
+            
+            updates = []
+            for product_id in changed_products:
+                row = index['rows'][product_id]
+                document = dict(zip(STAT_FIELDS, index['stats'][row].tolist()))
+                document['elasticity'] = float(index['elasticity'][row])
+                document['updated_at'] = index['refreshed_at']
+                updates.append(UpdateOne(
+                    {'org_id': org_id, 'product_id': product_id}, {'$set': document}, upsert=True
+                ))
+            if updates:
+                db.ai_elasticity_index.bulk_write(updates, ordered=False)
+            
+            db.ai_elasticity_meta.replace_one({'org_id': org_id}, {
+                'org_id': org_id,
+                'watermark': index['watermark'],
+                'refreshed_at': index['refreshed_at'],
+                'full_refreshed_at': index['full_refreshed_at']
+            }, upsert=True)
+        
+        except Exception as e:
+            print(f"Error saving elasticity index: {e}")
+    
+    def _load(self, org_id):
+        """Load an org's index from MongoDB, if available"""
+        try:
+            db = self.data_service.connect_db()
+            if db is None:
+                return None
+            
+            meta = db.ai_elasticity_meta.find_one({'org_id': org_id})
+            if meta is None:
+                return None
+            
+            documents = list(db.ai_elasticity_index.find({'org_id': org_id}))
+            stats = np.array(
+                [[document.get(field, 0) for field in STAT_FIELDS] for document in documents], dtype='float64'
+            ).reshape(len(documents), len(STAT_FIELDS))
+            
+            return {
+                'org_id': org_id,
+                'rows': {document['product_id']: row for row, document in enumerate(documents)},
+                'stats': stats,
+                'elasticity': elasticities_from_stats(stats, self.min_points),
+                'watermark': meta.get('watermark'),
+                'refreshed_at': meta['refreshed_at'],
+                'full_refreshed_at': meta['full_refreshed_at']
+            }
+        
+        except Exception as e:
+            print(f"Error loading elasticity index: {e}")
+            return None
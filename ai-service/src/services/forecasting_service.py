@@ -1,50 +1,334 @@
+import os
+import time
+import atexit
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait as wait_futures
+from concurrent.futures.process import BrokenProcessPool
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
-from prophet import Prophet
-from statsmodels.tsa.arima.model import ARIMA
 import warnings
+from .columnar import is_columnar, row_count
+from .lazy_imports import lazy_import
+from .model_cache import ModelCache, series_fingerprint
+from .batch_forecasting import BatchForecaster
+from .series_store import PreparedStock
 warnings.filterwarnings('ignore')
 
+# Per-process service used by pool workers, so each worker keeps its own model cache
+_worker_service = None
+
+def _forecast_worker(stock_data, product_info, org_id, product_id):
+    """Run one depletion forecast inside a pool worker process"""
+    global _worker_service
+    if _worker_service is None:
+        _worker_service = ForecastingService()
+    return _worker_service.predict_stock_depletion(stock_data, product_info, org_id, product_id)
+
 class ForecastingService:
     def __init__(self):
         self.min_data_points = 7  # Minimum data points for forecasting
+        self.model_cache = ModelCache(
+            max_size=int(os.getenv('FORECAST_CACHE_SIZE', 256)),
+            ttl=int(os.getenv('FORECAST_CACHE_TTL', 3600))
+        )
+        
+        # Bulk execution: 'serial' runs in the request thread, 'process' fans
+        # forecasts out over a process pool
+        self.executor_mode = os.getenv('FORECAST_EXECUTOR', 'serial')
+        self.max_workers = int(os.getenv('FORECAST_WORKERS', os.cpu_count() or 1))
+        self.task_timeout = float(os.getenv('FORECAST_TASK_TIMEOUT', 60))
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        
+        self.batch_forecaster = BatchForecaster(min_data_points=self.min_data_points)
+        
+        # Deadline-aware cascade: escalate past a tier only while its confidence
+        # is below this, using running fit-time estimates (ms) for each tier
+        self.cascade_confidence = float(os.getenv('FORECAST_CASCADE_CONFIDENCE', 0.7))
+        self._tier_cost_ms = {'arima': 500.0, 'prophet': 2500.0}
+        
+        # Last fitted ARIMA parameters per (org_id, product_id), kept well past
+        # the fitted models themselves to warm-start the next refit
+        self.arima_params = ModelCache(
+            max_size=int(os.getenv('ARIMA_PARAMS_CACHE_SIZE', 4096)),
+            ttl=int(os.getenv('ARIMA_PARAMS_CACHE_TTL', 604800))
+        )
+        self._arima_fit_stats = {
+            'cold': {'count': 0, 'total_ms': 0.0},
+            'warm': {'count': 0, 'total_ms': 0.0},
+            'saved_ms': 0.0
+        }
+        self._arima_stats_lock = threading.Lock()
     
-    def predict_stock_depletion(self, stock_data, product_info):
+    def predict_stock_depletion(self, stock_data, product_info, org_id=None, product_id=None, budget_ms=None):
         """
         Predict stock depletion date using time-series forecasting
         
         Args:
-            stock_data: List of stock movements with dates and quantities
+            stock_data: Stock movements with dates and quantities, either a
+                list of dicts or columnar NumPy arrays
             product_info: Product details including current stock and min stock
-            
+            org_id: Organization ID, used to key the fitted-model cache
+            product_id: Product ID, used to key the fitted-model cache
+            budget_ms: Latency budget; when set, run the holt -> ARIMA ->
+                Prophet cascade instead of always fitting Prophet
+        
         Returns:
             dict: Prediction results with depletion date and confidence
         """
         try:
-            if len(stock_data) < self.min_data_points:
+            if budget_ms is not None:
+                return self._cascade_prediction(stock_data, product_info, org_id, product_id, budget_ms)
+            
+            if row_count(stock_data) < self.min_data_points:
                 return self._simple_linear_prediction(stock_data, product_info)
             
+            df = self._prepare_data(stock_data)
+            cache_key = (org_id, product_id, series_fingerprint(df['ds'].values, df['y'].values))
+            
             # Try Prophet first, fallback to ARIMA
             try:
-                return self._prophet_forecast(stock_data, product_info)
+                return self._prophet_forecast(df, product_info, cache_key)
             except:
-                return self._arima_forecast(stock_data, product_info)
-                
+                return self._arima_forecast(df, product_info, cache_key)
+        
         except Exception as e:
-            return {
-                'success': False,
-                'error': str(e),
-                'depletion_date': None,
-                'days_remaining': None,
-                'confidence': 0
-            }
+            return self._failed_prediction(str(e))
+    
+    def _cascade_prediction(self, stock_data, product_info, org_id, product_id, budget_ms):
+        """
+        Answer with the cheapest model that is confident enough within budget
+        
+        Starts from the vectorized Holt estimate, replaced by the linear
+        estimate when Holt fails or flags a series too short for the full
+        models, then escalates to ARIMA and Prophet while the
+        current answer's confidence is below cascade_confidence and the tier's
+        expected fit time still fits in the remaining budget. Cached fits are
+        treated as free.
+        """
+        started = time.perf_counter()
+        steps = []
+        
+        def elapsed_ms():
+            return (time.perf_counter() - started) * 1000
+        
+        stock_data = self.prepare(stock_data)
+        
+        step_started = time.perf_counter()
+        prediction = self.batch_forecaster.predict(
+            {product_id: stock_data.columns()}, {product_id: product_info}
+        )[product_id]
+        needs_escalation = prediction.pop('needs_escalation', False)
+        short = row_count(stock_data) < self.min_data_points
+        if prediction.get('success'):
+            steps.append({
+                'tier': prediction['method'],
+                'ms': round((time.perf_counter() - step_started) * 1000, 1),
+                'confidence': prediction.get('confidence', 0)
+            })
+        
+        # Series too short for ARIMA/Prophet escalate to the linear estimate,
+        # as predict_stock_depletion answers them without a budget
+        if not prediction.get('success') or (needs_escalation and short):
+            step_started = time.perf_counter()
+            prediction = self._simple_linear_prediction(stock_data, product_info)
+            steps.append({
+                'tier': prediction.get('method', 'linear'),
+                'ms': round((time.perf_counter() - step_started) * 1000, 1),
+                'confidence': prediction.get('confidence', 0)
+            })
+        
+        if not short:
+            df = self._prepare_data(stock_data)
+            cache_key = (org_id, product_id, series_fingerprint(df['ds'].values, df['y'].values))
+            
+            for tier, forecast in (('arima', self._arima_forecast), ('prophet', self._prophet_forecast)):
+                if prediction.get('success') and prediction.get('confidence', 0) >= self.cascade_confidence:
+                    break
+                
+                cached = self.model_cache.contains(cache_key + (tier,))
+                expected_ms = 0 if cached else self._tier_cost_ms[tier]
+                if elapsed_ms() + expected_ms > budget_ms:
+                    steps.append({'tier': tier, 'skipped': 'budget', 'expected_ms': round(expected_ms)})
+                    break
+                
+                step_started = time.perf_counter()
+                try:
+                    result = forecast(df, product_info, cache_key)
+                except Exception as e:
+                    result = self._failed_prediction(str(e))
+                step_ms = (time.perf_counter() - step_started) * 1000
+                
+                # Keep a running estimate of real fit times for later budgeting
+                if not cached:
+                    self._tier_cost_ms[tier] = 0.7 * self._tier_cost_ms[tier] + 0.3 * step_ms
+                
+                steps.append({
+                    'tier': tier,
+                    'ms': round(step_ms, 1),
+                    'cached': cached,
+                    'confidence': result.get('confidence', 0)
+                })
+                if result.get('success'):
+                    prediction = result
+        
+        prediction['answered_by'] = prediction.get('method')
+        prediction['cascade'] = steps
+        prediction['elapsed_ms'] = round(elapsed_ms(), 1)
+        return prediction
+    
+    def predict_many(self, tasks):
+        """
+        Predict stock depletion for many products
+        
+        In 'process' mode forecasts run in a pool of worker processes, one
+        task per worker at a time. Each task has task_timeout seconds from
+        its submission; when one overruns, its worker cannot be cancelled,
+        so the pool is recycled (killing the stuck worker) and the other
+        unfinished tasks are resubmitted to the new pool.
+        
+        Args:
+            tasks: List of (stock_data, product_info, org_id, product_id) tuples
+        
+        Returns:
+            list: Prediction results in the same order as tasks
+        """
+        if self.executor_mode != 'process' or len(tasks) < 2:
+            return [self.predict_stock_depletion(*task) for task in tasks]
+        
+        results = [None] * len(tasks)
+        queued = deque(range(len(tasks)))
+        pending = {}  # future -> (task index, deadline)
+        
+        try:
+            executor = self._get_executor()
+            
+            while queued or pending:
+                while queued and len(pending) < self.max_workers:
+                    index = queued.popleft()
+                    future = executor.submit(_forecast_worker, *tasks[index])
+                    pending[future] = (index, time.monotonic() + self.task_timeout)
+                
+                earliest = min(deadline for _, deadline in pending.values())
+                done, _ = wait_futures(
+                    pending, timeout=max(0, earliest - time.monotonic()), return_when=FIRST_COMPLETED
+                )
+                
+                for future in done:
+                    index, _ = pending.pop(future)
+                    results[index] = future.result()
+                
+                now = time.monotonic()
+                expired = [future for future, (_, deadline) in pending.items() if deadline <= now]
+                if not expired:
+                    continue
+                
+                for future in expired:
+                    index, _ = pending.pop(future)
+                    results[index] = self._failed_prediction('Forecast timed out')
+                
+                # Running tasks cannot be cancelled: kill the pool and requeue
+                # the tasks that were still in flight on it
+                queued.extendleft(sorted((index for index, _ in pending.values()), reverse=True))
+                pending = {}
+                self.shutdown_executor(kill_workers=True)
+                executor = self._get_executor()
+        
+        except BrokenProcessPool as e:
+            print(f"Forecast process pool failed, continuing serially: {e}")
+            self.shutdown_executor()
+            
+            for index, task in enumerate(tasks):
+                if results[index] is None:
+                    results[index] = self.predict_stock_depletion(*task)
+        
+        return results
     
-    def _prophet_forecast(self, stock_data, product_info):
+    def predict_batch(self, stock_by_product, info_by_product, org_id=None, escalate=True):
+        """
+        Predict stock depletion for a whole catalog with the vectorized engine
+        
+        All products are forecast in one NumPy pass; products the fast model
+        is unsure about are escalated to the full Prophet/ARIMA path.
+        
+        Args:
+            stock_by_product: Product ID to stock data
+            info_by_product: Product ID to product info
+            org_id: Organization ID, used to key the fitted-model cache
+            escalate: Re-forecast low-confidence products with full models
+        
+        Returns:
+            dict: Product ID to prediction result
+        """
+        predictions = self.batch_forecaster.predict(stock_by_product, info_by_product)
+        
+        escalated = [p for p, prediction in predictions.items() if prediction.pop('needs_escalation')]
+        if escalate and escalated:
+            results = self.predict_many([
+                (stock_by_product.get(p, []), info_by_product[p], org_id, p)
+                for p in escalated
+            ])
+            predictions.update(zip(escalated, results))
+        
+        return predictions
+    
+    def _get_executor(self):
+        """Get the forecast process pool, creating it on first use"""
+        with self._executor_lock:
+            if self._executor is None:
+                # spawn avoids forking a threaded server with open DB sockets
+                context = multiprocessing.get_context(os.getenv('FORECAST_START_METHOD', 'spawn'))
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+                atexit.register(self.shutdown_executor)
+            return self._executor
+    
+    def shutdown_executor(self, kill_workers=False):
+        """
+        Shut down the forecast process pool if it is running
+        
+        Args:
+            kill_workers: Terminate worker processes still running a task,
+                instead of letting them finish
+        """
+        with self._executor_lock:
+            if self._executor is not None:
+                # The pool forgets its processes on shutdown, collect them first
+                processes = list((self._executor._processes or {}).values()) if kill_workers else []
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                for process in processes:
+                    process.terminate()
+                self._executor = None
+    
+    def _failed_prediction(self, error):
+        """Prediction result for a product that could not be forecast"""
+        return {
+            'success': False,
+            'error': error,
+            'depletion_date': None,
+            'days_remaining': None,
+            'confidence': 0
+        }
+    
+    def invalidate_cache(self, org_id=None, product_id=None):
+        """Drop cached forecasts and warm-start parameters for an org and/or product"""
+        self.arima_params.invalidate(org_id, product_id)
+        return self.model_cache.invalidate(org_id, product_id)
+    
+    def _prophet_forecast(self, df, product_info, cache_key):
         """Prophet-based forecasting"""
-        df = self._prepare_data(stock_data)
+        cached = self.model_cache.get_or_create(
+            cache_key + ('prophet',), lambda: self._fit_prophet(df)
+        )
+        
+        return self._calculate_depletion_date(cached['forecast'].copy(), product_info, 'prophet')
+    
+    def _fit_prophet(self, df):
+        """Fit Prophet and forecast the next 90 days"""
+        Prophet = lazy_import('prophet').Prophet
         
-        # Create Prophet model
         model = Prophet(
             daily_seasonality=False,
             weekly_seasonality=True,
@@ -54,32 +338,95 @@ class ForecastingService:
         
         model.fit(df)
         
-        # Forecast next 90 days
         future = model.make_future_dataframe(periods=90)
-        forecast = model.predict(future)
-        
-        return self._calculate_depletion_date(forecast, product_info, 'prophet')
+        return {'model': model, 'forecast': model.predict(future)}
     
-    def _arima_forecast(self, stock_data, product_info):
+    def _arima_forecast(self, df, product_info, cache_key):
         """ARIMA-based forecasting"""
-        df = self._prepare_data(stock_data)
+        cached = self.model_cache.get_or_create(
+            cache_key + ('arima',), lambda: self._fit_arima(df, cache_key[:2])
+        )
         
-        # Auto ARIMA parameters
+        prediction = self._calculate_depletion_date(cached['forecast'].copy(), product_info, 'arima')
+        prediction['fit'] = cached['fit']
+        return prediction
+    
+    def _fit_arima(self, df, product_key=(None, None)):
+        """
+        Fit ARIMA(1,1,1) and forecast the next 90 days
+        
+        The parameters of a product's previous fit seed the optimizer, so a
+        refit after a few new days converges in a handful of iterations.
+        """
+        ARIMA = lazy_import('statsmodels.tsa.arima.model').ARIMA
+        
+        warm_key = product_key if product_key[1] is not None else None
+        start_params = self.arima_params.get(warm_key) if warm_key else None
+        
+        started = time.perf_counter()
         model = ARIMA(df['y'], order=(1, 1, 1))
-        fitted_model = model.fit()
+        try:
+            fitted_model = model.fit(start_params=start_params)
+        except Exception:
+            if start_params is None:
+                raise
+            # Stale parameters the new data cannot start from, fit cold
+            start_params = None
+            fitted_model = model.fit()
+        fit_ms = (time.perf_counter() - started) * 1000
+        
+        if warm_key:
+            self.arima_params.put(warm_key, np.asarray(fitted_model.params))
         
-        # Forecast next 90 days
         forecast = fitted_model.forecast(steps=90)
         forecast_df = pd.DataFrame({
             'ds': pd.date_range(start=df['ds'].max() + timedelta(days=1), periods=90),
             'yhat': forecast
         })
         
-        return self._calculate_depletion_date(forecast_df, product_info, 'arima')
+        return {
+            'model': fitted_model,
+            'forecast': forecast_df,
+            'fit': self._record_arima_fit(fit_ms, start_params is not None, fitted_model)
+        }
+    
+    def _record_arima_fit(self, fit_ms, warm_start, fitted_model):
+        """Track cold and warm ARIMA fit times and estimate the time a warm start saved"""
+        with self._arima_stats_lock:
+            stats = self._arima_fit_stats['warm' if warm_start else 'cold']
+            stats['count'] += 1
+            stats['total_ms'] += fit_ms
+            
+            cold = self._arima_fit_stats['cold']
+            saved_ms = None
+            if warm_start and cold['count']:
+                saved_ms = cold['total_ms'] / cold['count'] - fit_ms
+                self._arima_fit_stats['saved_ms'] += saved_ms
+        
+        return {
+            'warm_start': warm_start,
+            'fit_ms': round(fit_ms, 1),
+            'iterations': fitted_model.mle_retvals.get('iterations') if fitted_model.mle_retvals else None,
+            'saved_ms': round(saved_ms, 1) if saved_ms is not None else None
+        }
+    
+    def arima_fit_stats(self):
+        """Cold vs warm-started ARIMA fit counts, mean fit times and total time saved"""
+        with self._arima_stats_lock:
+            report = {}
+            for kind in ('cold', 'warm'):
+                stats = self._arima_fit_stats[kind]
+                report[kind] = {
+                    'count': stats['count'],
+                    'mean_ms': round(stats['total_ms'] / stats['count'], 1) if stats['count'] else None
+                }
+            report['saved_ms'] = round(self._arima_fit_stats['saved_ms'], 1)
+            report['stored_params'] = self.arima_params.stats()['size']
+            return report
     
     def _simple_linear_prediction(self, stock_data, product_info):
         """Simple linear regression for limited data"""
-        if len(stock_data) < 2:
+        if row_count(stock_data) < 2:
             return {
                 'success': False,
                 'error': 'Insufficient data for prediction',
@@ -88,20 +435,14 @@ class ForecastingService:
                 'confidence': 0
             }
         
-        # Calculate average daily consumption
-        df = pd.DataFrame(stock_data)
-        df['date'] = pd.to_datetime(df['date'])
-        df = df.sort_values('date')
-        
-        # Calculate daily stock changes
-        daily_changes = []
-        for i in range(1, len(df)):
-            days_diff = (df.iloc[i]['date'] - df.iloc[i-1]['date']).days
-            stock_change = df.iloc[i]['balance'] - df.iloc[i-1]['balance']
-            if days_diff > 0:
-                daily_changes.append(stock_change / days_diff)
-        
-        if not daily_changes:
+        # Calculate daily stock changes between consecutive movements
+        df = self.prepare(stock_data).frame
+        days_diff = np.diff(df['date'].values) // np.timedelta64(1, 'D')
+        stock_change = np.diff(df['balance'].to_numpy(dtype='float64'))
+        valid = days_diff > 0
+        daily_changes = stock_change[valid] / days_diff[valid]
+        
+        if daily_changes.size == 0:
             return {
                 'success': False,
                 'error': 'No valid stock changes found',
@@ -110,7 +451,9 @@ class ForecastingService:
                 'confidence': 0
             }
         
-        avg_daily_consumption = -np.mean([x for x in daily_changes if x < 0])
+        # Average consumption on days that stock went down
+        depleting = daily_changes[daily_changes < 0]
+        avg_daily_consumption = -depleting.mean() if depleting.size else 0
         
         if avg_daily_consumption <= 0:
             return {
@@ -137,21 +480,34 @@ class ForecastingService:
             'avg_daily_consumption': avg_daily_consumption
         }
     
-    def _prepare_data(self, stock_data):
-        """Prepare data for Prophet/ARIMA"""
-        df = pd.DataFrame(stock_data)
-        df['date'] = pd.to_datetime(df['date'])
-        df = df.sort_values('date')
+    def prepare(self, stock_data):
+        """
+        Parse and sort stock data once for reuse within a request
+        
+        Accepts a list of dicts, columnar NumPy arrays or an already
+        PreparedStock, which is returned unchanged.
+        """
+        if isinstance(stock_data, PreparedStock):
+            return stock_data
+        
+        if row_count(stock_data) == 0:
+            return PreparedStock(pd.DataFrame({
+                'date': pd.Series(dtype='datetime64[ns]'),
+                'balance': pd.Series(dtype='float64'),
+                'quantity': pd.Series(dtype='float64')
+            }))
         
-        # Rename columns for Prophet
-        df = df.rename(columns={'date': 'ds', 'balance': 'y'})
+        df = pd.DataFrame(stock_data)
         
-        # Fill missing dates
-        date_range = pd.date_range(start=df['ds'].min(), end=df['ds'].max(), freq='D')
-        df = df.set_index('ds').reindex(date_range).interpolate().reset_index()
-        df = df.rename(columns={'index': 'ds'})
+        # Columnar data already holds datetime64 dates, only records need parsing
+        if not is_columnar(stock_data):
+            df['date'] = pd.to_datetime(df['date'])
         
-        return df
+        return PreparedStock(df.sort_values('date', kind='stable').reset_index(drop=True))
+    
+    def _prepare_data(self, stock_data):
+        """Prepare data for Prophet/ARIMA"""
+        return self.prepare(stock_data).daily
     
     def _calculate_depletion_date(self, forecast_df, product_info, method):
         """Calculate depletion date from forecast"""
@@ -192,12 +548,10 @@ class ForecastingService:
     
     def get_stock_insights(self, stock_data, product_info):
         """Get additional stock insights"""
-        if len(stock_data) < 2:
+        if row_count(stock_data) < 2:
             return {'insights': []}
         
-        df = pd.DataFrame(stock_data)
-        df['date'] = pd.to_datetime(df['date'])
-        df = df.sort_values('date')
+        df = self.prepare(stock_data).frame
         
         insights = []
         
@@ -0,0 +1,288 @@
+import os
+import uuid
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+class JobService:
+    """
+    Background jobs for org-wide forecasting and pricing
+    
+    A job splits its items into chunks and runs a handler on each chunk in a
+    worker thread, collecting results and progress as it goes. The process
+    running a job keeps it in memory and writes its status and each chunk's
+    results to MongoDB, so any worker can report on, page through or cancel
+    it. Jobs are dropped JOB_TTL seconds after finishing. Without MongoDB,
+    jobs are only visible to the worker that runs them.
+    """
+    
+    def __init__(self, data_service=None):
+        self.data_service = data_service
+        self.chunk_size = int(os.getenv('JOB_CHUNK_SIZE', 100))
+        self.ttl = int(os.getenv('JOB_TTL', 86400))
+        self.executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv('JOB_WORKERS', 2)),
+            thread_name_prefix='ai-job'
+        )
+        self._jobs = {}
+        self._lock = threading.Lock()
+    
+    def submit(self, kind, org_id, items, handler, params=None):
+        """
+        Queue a job
+        
+        Args:
+            kind: Job type, e.g. 'forecast' or 'pricing'
+            org_id: Organization ID
+            items: Items to process, e.g. product IDs
+            handler: Callable(org_id, chunk) returning a list of results
+            params: Request parameters to report back with the job
+        
+        Returns:
+            dict: Job status
+        """
+        self._cleanup()
+        
+        job_id = uuid.uuid4().hex
+        job = {
+            'job_id': job_id,
+            'kind': kind,
+            'org_id': org_id,
+            'params': params or {},
+            'status': 'queued',
+            'total': len(items),
+            'processed': 0,
+            'errors': [],
+            'results': [],
+            'cancelled': False,
+            'created_at': datetime.now(),
+            'started_at': None,
+            'finished_at': None
+        }
+        
+        with self._lock:
+            self._jobs[job_id] = job
+        self._save(job, created=True)
+        
+        self.executor.submit(self._run, job, list(items), handler)
+        return self.get(job_id)
+    
+    def _run(self, job, items, handler):
+        """Process a job's items chunk by chunk"""
+        self._sync_cancelled(job)
+        with self._lock:
+            if job['cancelled']:
+                return
+            job['status'] = 'running'
+            job['started_at'] = datetime.now()
+        self._save(job)
+        
+        for start in range(0, len(items), self.chunk_size):
+            if self._sync_cancelled(job):
+                break
+            
+            chunk = items[start:start + self.chunk_size]
+            try:
+                results = handler(job['org_id'], chunk)
+            except Exception as e:
+                print(f"Job {job['job_id']} chunk at {start} failed: {e}")
+                results = []
+                with self._lock:
+                    job['errors'].append({'offset': start, 'count': len(chunk), 'error': str(e)})
+            
+            self._save_results(job['job_id'], len(job['results']), results)
+            with self._lock:
+                job['results'].extend(results)
+                job['processed'] += len(chunk)
+            self._save(job)
+        
+        with self._lock:
+            job['status'] = 'cancelled' if job['cancelled'] else 'completed'
+            job['finished_at'] = datetime.now()
+        self._save(job)
+    
+    def get(self, job_id):
+        """Job status and progress, without results"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return self._describe(job, len(job['results']))
+        
+        stored = self._load(job_id)
+        return None if stored is None else self._describe(stored, stored['result_count'])
+    
+    def _describe(self, job, result_count):
+        """Public status of an in-memory or stored job"""
+        return {
+            'job_id': job['job_id'],
+            'kind': job['kind'],
+            'org_id': job['org_id'],
+            'params': job['params'],
+            'status': job['status'],
+            'total': job['total'],
+            'processed': job['processed'],
+            'progress': round(job['processed'] / job['total'], 3) if job['total'] else 1.0,
+            'result_count': result_count,
+            'errors': list(job['errors']),
+            'created_at': job['created_at'].isoformat(),
+            'started_at': job['started_at'].isoformat() if job['started_at'] else None,
+            'finished_at': job['finished_at'].isoformat() if job['finished_at'] else None
+        }
+    
+    def get_results(self, job_id, page=1, limit=100):
+        """One page of a job's results, available while the job is still running"""
+        start = (page - 1) * limit
+        
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                status = job['status']
+                total = len(job['results'])
+                results = job['results'][start:start + limit]
+        
+        if job is None:
+            job = self._load(job_id)
+            if job is None:
+                return None
+            status = job['status']
+            total = job['result_count']
+            results = self._load_results(job_id, start, limit)
+        
+        return {
+            'job_id': job_id,
+            'status': status,
+            'results': results,
+            'pagination': {
+                'page': page,
+                'limit': limit,
+                'total': total,
+                'pages': -(-total // limit)
+            }
+        }
+    
+    def cancel(self, job_id):
+        """Stop a job after its current chunk"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job['status'] in ('queued', 'running'):
+                job['cancelled'] = True
+                if job['status'] == 'queued':
+                    job['status'] = 'cancelled'
+                    job['finished_at'] = datetime.now()
+        
+        if job is not None:
+            self._save(job, cancelled=job['cancelled'])
+            return self.get(job_id)
+        
+        # Run by another worker, which picks the flag up before its next chunk
+        try:
+            db = self._db()
+            if db is None:
+                return None
+            
+            db.ai_jobs.update_one(
+                {'job_id': job_id, 'status': 'queued'},
+                {'$set': {'cancelled': True, 'status': 'cancelled', 'finished_at': datetime.now()}}
+            )
+            db.ai_jobs.update_one({'job_id': job_id, 'status': 'running'}, {'$set': {'cancelled': True}})
+        except Exception as e:
+            print(f"Error cancelling job {job_id}: {e}")
+        
+        return self.get(job_id)
+    
+    def _cleanup(self):
+        """Drop finished jobs older than the TTL"""
+        cutoff = datetime.now() - timedelta(seconds=self.ttl)
+        with self._lock:
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job['finished_at'] is not None and job['finished_at'] < cutoff
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
+        
+        try:
+            db = self._db()
+            if db is not None:
+                query = {'finished_at': {'$lt': cutoff}}
+                expired = db.ai_jobs.distinct('job_id', query)
+                if expired:
+                    db.ai_job_results.delete_many({'job_id': {'$in': expired}})
+                    db.ai_jobs.delete_many({'job_id': {'$in': expired}})
+        except Exception as e:
+            print(f"Error removing expired jobs: {e}")
+    
+    def _db(self):
+        """The MongoDB database jobs are shared through, or None"""
+        return self.data_service.connect_db() if self.data_service is not None else None
+    
+    def _sync_cancelled(self, job):
+        """Pick up a cancellation requested through another worker"""
+        if not job['cancelled']:
+            try:
+                db = self._db()
+                stored = db.ai_jobs.find_one({'job_id': job['job_id']}, {'cancelled': 1}) if db is not None else None
+                if stored and stored.get('cancelled'):
+                    with self._lock:
+                        job['cancelled'] = True
+            except Exception as e:
+                print(f"Error checking job {job['job_id']}: {e}")
+        
+        return job['cancelled']
+    
+    def _save(self, job, created=False, cancelled=False):
+        """Persist a job's status to MongoDB, if available"""
+        try:
+            db = self._db()
+            if db is None:
+                return
+            
+            with self._lock:
+                document = {key: value for key, value in job.items() if key not in ('results', 'cancelled')}
+                document['result_count'] = len(job['results'])
+            
+            # The cancel flag is only ever raised, so routine saves cannot
+            # clear one set through another worker
+            if created or cancelled:
+                document['cancelled'] = job['cancelled']
+            
+            db.ai_jobs.update_one({'job_id': job['job_id']}, {'$set': document}, upsert=True)
+        except Exception as e:
+            print(f"Error saving job {job['job_id']}: {e}")
+    
+    def _save_results(self, job_id, offset, results):
+        """Persist one chunk's results to MongoDB, numbered from offset"""
+        try:
+            db = self._db()
+            if db is not None and results:
+                db.ai_job_results.insert_many([
+                    {'job_id': job_id, 'seq': offset + i, 'result': result}
+                    for i, result in enumerate(results)
+                ], ordered=False)
+        except Exception as e:
+            print(f"Error saving results of job {job_id}: {e}")
+    
+    def _load(self, job_id):
+        """Load a job's status from MongoDB, if available"""
+        try:
+            db = self._db()
+            if db is not None:
+                return db.ai_jobs.find_one({'job_id': job_id}, {'_id': 0})
+        except Exception as e:
+            print(f"Error loading job {job_id}: {e}")
+        
+        return None
+    
+    def _load_results(self, job_id, start, limit):
+        """Load a page of a job's results from MongoDB"""
+        try:
+            db = self._db()
+            if db is not None:
+                cursor = db.ai_job_results.find(
+                    {'job_id': job_id, 'seq': {'$gte': start, '$lt': start + limit}}, {'_id': 0, 'result': 1}
+                ).sort('seq', 1)
+                return [document['result'] for document in cursor]
+        except Exception as e:
+            print(f"Error loading results of job {job_id}: {e}")
+        
+        return []
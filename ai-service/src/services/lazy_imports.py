@@ -0,0 +1,39 @@
+import sys
+import time
+import warnings
+import importlib
+import threading
+
+# Heavy optional libraries (prophet, statsmodels, sklearn) are imported on
+# first use so that workers serving /health or the linear path start fast.
+_import_times = {}
+_import_lock = threading.Lock()
+_process_started = time.time()
+
+def lazy_import(name):
+    """Import a module on first use and record how long the import took"""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    
+    with _import_lock:
+        module = sys.modules.get(name)
+        if module is None:
+            start = time.perf_counter()
+            module = importlib.import_module(name)
+            _import_times[name] = round(time.perf_counter() - start, 3)
+            
+            # Libraries like statsmodels install their own warning filters on
+            # import; restore the services' blanket ignore ahead of them
+            warnings.filterwarnings('ignore')
+            print(f"Loaded {name} in {_import_times[name]}s")
+    
+    return module
+
+def import_report():
+    """Timing breakdown of the lazily imported modules in this process"""
+    return {
+        'modules': dict(_import_times),
+        'total_import_seconds': round(sum(_import_times.values()), 3),
+        'uptime_seconds': round(time.time() - _process_started, 1)
+    }
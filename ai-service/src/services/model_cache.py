@@ -0,0 +1,100 @@
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+def series_fingerprint(*arrays):
+    """Hash the raw bytes of one or more NumPy arrays"""
+    digest = hashlib.sha1()
+    for array in arrays:
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+class ModelCache:
+    """
+    Thread-safe LRU cache with per-entry TTL for fitted models
+    
+    Keys are tuples whose first two items are org_id and product_id, so
+    entries can be invalidated per org or per product.
+    """
+    
+    def __init__(self, max_size=256, ttl=3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'invalidations': 0}
+    
+    def get(self, key):
+        """Get a cached value, or None if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self._stats['expirations'] += 1
+                self._stats['misses'] += 1
+                return None
+            
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return value
+    
+    def contains(self, key):
+        """Check for a live entry without touching LRU order or stats"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry[0] >= time.monotonic()
+    
+    def put(self, key, value):
+        """Store a value, evicting the least recently used entries if full"""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+    
+    def get_or_create(self, key, factory):
+        """Get a cached value or build it with factory() and cache it"""
+        value = self.get(key)
+        if value is None:
+            value = factory()
+            self.put(key, value)
+        return value
+    
+    def invalidate(self, org_id=None, product_id=None):
+        """Drop entries for an org and/or product; no arguments clears everything"""
+        with self._lock:
+            if org_id is None and product_id is None:
+                removed = len(self._entries)
+                self._entries.clear()
+            else:
+                stale = [
+                    key for key in self._entries
+                    if (org_id is None or key[0] == org_id)
+                    and (product_id is None or key[1] == product_id)
+                ]
+                for key in stale:
+                    del self._entries[key]
+                removed = len(stale)
+            
+            self._stats['invalidations'] += removed
+            return removed
+    
+    def stats(self):
+        """Cache size, limits and hit/miss/eviction counters"""
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['misses']
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hit_rate': round(self._stats['hits'] / lookups, 3) if lookups else 0,
+                **self._stats
+            }
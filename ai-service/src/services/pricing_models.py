@@ -0,0 +1,123 @@
+import os
+import threading
+from collections import namedtuple
+from datetime import datetime
+from .lazy_imports import lazy_import
+from .model_cache import ModelCache
+
+# A trained pricing model. Handles are never modified once published, so a
+# request keeps using the one it got even if the registry retrains meanwhile.
+PricingModel = namedtuple('PricingModel', [
+    'scaler', 'model', 'trained_rows', 'trained_through', 'trained_at'
+])
+
+# Training locks are striped by key hash, so their number stays fixed however
+# many products are trained
+TRAIN_LOCK_STRIPES = 64
+
+class PricingModelRegistry:
+    """
+    Trained pricing models per (org_id, product_id)
+    
+    A product's model is reused until PRICING_RETRAIN_SALES new sales have
+    arrived after the last sale it was trained on, or it is older than
+    PRICING_MODEL_MAX_AGE seconds. Only one request retrains a given product
+    at a time; the others wait for and reuse its result. Products sharing a
+    lock stripe also train one after another.
+    """
+    
+    def __init__(self):
+        self.retrain_after_sales = int(os.getenv('PRICING_RETRAIN_SALES', 20))
+        self.n_jobs = int(os.getenv('PRICING_MODEL_JOBS', -1))
+        self._models = ModelCache(
+            max_size=int(os.getenv('PRICING_MODEL_CACHE_SIZE', 1024)),
+            ttl=int(os.getenv('PRICING_MODEL_MAX_AGE', 86400))
+        )
+        self._train_locks = [threading.Lock() for _ in range(TRAIN_LOCK_STRIPES)]
+        self._lock = threading.Lock()
+        self._stats = {'trained': 0, 'reused': 0}
+    
+    def get(self, org_id, product_id, X, y, sale_dates):
+        """
+        Get a fresh model for a product, training one if needed
+        
+        Args:
+            org_id: Organization ID
+            product_id: Product ID; without one the model is trained for
+                this call only
+            X: Feature matrix
+            y: Training target
+            sale_dates: datetime64 dates of the sales behind X
+        
+        Returns:
+            PricingModel: Immutable model handle
+        """
+        if org_id is None or product_id is None:
+            return self._train(X, y, sale_dates)
+        
+        key = (org_id, product_id)
+        handle = self._models.get(key)
+        if self._is_fresh(handle, sale_dates):
+            self._count('reused')
+            return handle
+        
+        with self._train_locks[hash(key) % TRAIN_LOCK_STRIPES]:
+            # Another request may have retrained while this one waited
+            handle = self._models.get(key)
+            if self._is_fresh(handle, sale_dates):
+                self._count('reused')
+                return handle
+            
+            handle = self._train(X, y, sale_dates)
+            self._models.put(key, handle)
+        
+        return handle
+    
+    def invalidate(self, org_id=None, product_id=None):
+        """Drop models for an org and/or product"""
+        return self._models.invalidate(org_id, product_id)
+    
+    def stats(self):
+        """Registry size and train/reuse counters"""
+        with self._lock:
+            counters = dict(self._stats)
+        
+        return {
+            **self._models.stats(),
+            **counters,
+            'retrain_after_sales': self.retrain_after_sales,
+            'n_jobs': self.n_jobs
+        }
+    
+    def _is_fresh(self, handle, sale_dates):
+        """Check whether fewer than retrain_after_sales sales are newer than a model"""
+        if handle is None:
+            return False
+        return int((sale_dates > handle.trained_through).sum()) < self.retrain_after_sales
+    
+    def _train(self, X, y, sale_dates):
+        """Fit the scaler and Random Forest on a product's features"""
+        scaler = lazy_import('sklearn.preprocessing').StandardScaler()
+        X_scaled = scaler.fit_transform(X)
+        
+        # Train Random Forest model, growing trees in parallel
+        RandomForestRegressor = lazy_import('sklearn.ensemble').RandomForestRegressor
+        model = RandomForestRegressor(n_estimators=50, random_state=42, n_jobs=self.n_jobs)
+        model.fit(X_scaled, y)
+        
+        # Single-row predictions are faster without thread dispatch
+        model.set_params(n_jobs=None)
+        
+        self._count('trained')
+        return PricingModel(
+            scaler=scaler,
+            model=model,
+            trained_rows=len(X),
+            trained_through=sale_dates.max() if len(sale_dates) else None,
+            trained_at=datetime.now()
+        )
+    
+    def _count(self, name):
+        """Increment a registry counter"""
+        with self._lock:
+            self._stats[name] += 1
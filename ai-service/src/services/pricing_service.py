@@ -1,35 +1,50 @@
+import os
 import pandas as pd
 import numpy as np
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.linear_model import LinearRegression
-from sklearn.preprocessing import StandardScaler
 from datetime import datetime, timedelta
-import requests
-from bs4 import BeautifulSoup
 import re
+import time
+import threading
 import warnings
+from urllib.parse import quote_plus, urlparse
+from concurrent.futures import ThreadPoolExecutor
+from .columnar import is_columnar, row_count, column
+from .lazy_imports import lazy_import
+from .pricing_models import PricingModelRegistry
+from .model_cache import ModelCache
 warnings.filterwarnings('ignore')
 
+# Features the pricing model is trained on
+PRICING_FEATURE_COLUMNS = [
+    'cost_price', 'day_of_week', 'month', 'is_weekend',
+    'avg_price_7d', 'avg_quantity_7d', 'price_trend_7d',
+    'min_competitor_price', 'max_competitor_price', 'avg_competitor_price'
+]
+
 class PricingService:
-    def __init__(self):
-        self.model = None
-        self.scaler = StandardScaler()
+    def __init__(self, elasticity_index=None):
+        self.model_registry = PricingModelRegistry()
+        self.elasticity_index = elasticity_index
         self.min_data_points = 10
-        
-    def calculate_optimal_price(self, product_data, sales_history, competitor_prices=None):
+        self.price_grid_points = int(os.getenv('PRICING_GRID_POINTS', 501))
+    
+    def calculate_optimal_price(self, product_data, sales_history, competitor_prices=None, org_id=None, product_id=None):
         """
         Calculate optimal price using AI regression models
         
         Args:
             product_data: Product information (cost, current price, etc.)
-            sales_history: Historical sales data
+            sales_history: Historical sales data, either a list of dicts or
+                columnar NumPy arrays
             competitor_prices: Scraped competitor pricing data
-            
+            org_id: Organization ID, used to key the model registry
+            product_id: Product ID, used to key the model registry
+        
         Returns:
             dict: Pricing recommendations with confidence
         """
         try:
-            if len(sales_history) < self.min_data_points:
+            if row_count(sales_history) < self.min_data_points:
                 return self._simple_pricing_model(product_data, sales_history)
             
             # Prepare features for ML model
@@ -39,16 +54,18 @@ class PricingService:
                 return self._simple_pricing_model(product_data, sales_history)
             
             # Train and predict
-            optimal_price = self._ml_pricing_model(features_df, sales_history)
+            optimal_price = self._ml_pricing_model(features_df, sales_history, product_data, org_id, product_id)
             
-            # Calculate demand elasticity
-            elasticity = self._calculate_demand_elasticity(sales_history)
+            # Demand elasticity, from the elasticity index when it covers the product
+            elasticity = self._indexed_elasticity(org_id, product_id)
+            if elasticity is None:
+                elasticity = self._calculate_demand_elasticity(sales_history)
             
             # Generate pricing recommendations
             return self._generate_pricing_recommendations(
                 product_data, optimal_price, elasticity, competitor_prices
             )
-            
+        
         except Exception as e:
             return {
                 'success': False,
@@ -59,139 +76,166 @@ class PricingService:
     
     def _prepare_features(self, product_data, sales_history, competitor_prices):
         """Prepare feature matrix for ML model"""
+        df = self._sales_frame(sales_history)
+        
+        size = len(df)
+        price = df['unit_price'].to_numpy() if 'unit_price' in df else np.zeros(size, dtype='int64')
+        quantity = df['quantity'].to_numpy() if 'quantity' in df else np.zeros(size, dtype='int64')
+        dates = pd.DatetimeIndex(df['date'])
+        day_of_week = dates.dayofweek.to_numpy(dtype='int64')
+        
+        # Historical averages over the 7 sales before each row; the first 7
+        # rows have no full window and fall back to the row itself
+        has_window = np.arange(size) >= 7
+        prior_prices = pd.Series(price).shift(1)
+        avg_price_7d = np.where(has_window, prior_prices.rolling(7, min_periods=1).mean(), price)
+        avg_quantity_7d = np.where(
+            has_window, pd.Series(quantity).shift(1).rolling(7, min_periods=1).mean(), quantity
+        )
+        price_trend_7d = np.where(has_window, prior_prices - pd.Series(price).shift(7), 0)
+        
+        # Competitor pricing features, aggregated once and broadcast
+        if competitor_prices:
+            competitor_values = [p['price'] for p in competitor_prices]
+            avg_competitor_price = np.mean(competitor_values)
+            competitor_features = {
+                'min_competitor_price': np.full(size, min(competitor_values)),
+                'max_competitor_price': np.full(size, max(competitor_values)),
+                'avg_competitor_price': np.full(size, avg_competitor_price),
+                'price_vs_competitors': price - avg_competitor_price
+            }
+        else:
+            competitor_features = {
+                'min_competitor_price': price,
+                'max_competitor_price': price,
+                'avg_competitor_price': price,
+                'price_vs_competitors': np.zeros(size, dtype='int64')
+            }
+        
+        # Revenue and margin
+        cost_price = product_data.get('cost_price', 0)
+        margin = price - cost_price
+        margin_percent = np.zeros(size)
+        np.divide(margin * 100, price, out=margin_percent, where=price > 0)
+        
+        return pd.DataFrame({
+            'price': price,
+            'quantity_sold': quantity,
+            'cost_price': np.full(size, cost_price),
+            'day_of_week': day_of_week,
+            'month': dates.month.to_numpy(dtype='int64'),
+            'is_weekend': (day_of_week >= 5).astype('int64'),
+            'avg_price_7d': avg_price_7d,
+            'avg_quantity_7d': avg_quantity_7d,
+            'price_trend_7d': price_trend_7d,
+            **competitor_features,
+            'revenue': price * quantity,
+            'margin': margin,
+            'margin_percent': margin_percent
+        })
+    
+    def _sales_frame(self, sales_history):
+        """Build a date-sorted DataFrame from either sales history format"""
         df = pd.DataFrame(sales_history)
-        df['date'] = pd.to_datetime(df['date'])
-        df = df.sort_values('date')
         
-        # Create features
-        features = []
-        for i in range(len(df)):
-            row = df.iloc[i]
-            
-            # Base features
-            feature_row = {
-                'price': row.get('unit_price', 0),
-                'quantity_sold': row.get('quantity', 0),
-                'cost_price': product_data.get('cost_price', 0),
-                'day_of_week': row['date'].dayofweek,
-                'month': row['date'].month,
-                'is_weekend': 1 if row['date'].dayofweek >= 5 else 0
-            }
-            
-            # Historical averages (last 7 days)
-            if i >= 7:
-                recent_data = df.iloc[i-7:i]
-                feature_row.update({
-                    'avg_price_7d': recent_data['unit_price'].mean() if 'unit_price' in recent_data else 0,
-                    'avg_quantity_7d': recent_data['quantity'].mean() if 'quantity' in recent_data else 0,
-                    'price_trend_7d': (recent_data['unit_price'].iloc[-1] - recent_data['unit_price'].iloc[0]) if len(recent_data) > 1 else 0
-                })
-            else:
-                feature_row.update({
-                    'avg_price_7d': feature_row['price'],
-                    'avg_quantity_7d': feature_row['quantity_sold'],
-                    'price_trend_7d': 0
-                })
-            
-            # Competitor pricing features
-            if competitor_prices:
-                feature_row.update({
-                    'min_competitor_price': min([p['price'] for p in competitor_prices]),
-                    'max_competitor_price': max([p['price'] for p in competitor_prices]),
-                    'avg_competitor_price': np.mean([p['price'] for p in competitor_prices]),
-                    'price_vs_competitors': feature_row['price'] - np.mean([p['price'] for p in competitor_prices])
-                })
-            else:
-                feature_row.update({
-                    'min_competitor_price': feature_row['price'],
-                    'max_competitor_price': feature_row['price'],
-                    'avg_competitor_price': feature_row['price'],
-                    'price_vs_competitors': 0
-                })
-            
-            # Revenue and margin
-            feature_row['revenue'] = feature_row['price'] * feature_row['quantity_sold']
-            feature_row['margin'] = feature_row['price'] - feature_row['cost_price']
-            feature_row['margin_percent'] = (feature_row['margin'] / feature_row['price']) * 100 if feature_row['price'] > 0 else 0
-            
-            features.append(feature_row)
+        # Columnar data already holds datetime64 dates, only records need parsing
+        if not is_columnar(sales_history):
+            df['date'] = pd.to_datetime(df['date'])
         
-        return pd.DataFrame(features)
+        return df.sort_values('date')
     
-    def _ml_pricing_model(self, features_df, sales_history):
-        """Train ML model and predict optimal price"""
+    def _ml_pricing_model(self, features_df, sales_history, product_data, org_id=None, product_id=None):
+        """Predict with the product's registered model (training it if stale) and find the optimal price"""
         # Prepare target variable (revenue per unit)
         y = features_df['revenue'] / (features_df['quantity_sold'] + 1)  # Avoid division by zero
         
-        # Select features for training
-        feature_cols = [
-            'cost_price', 'day_of_week', 'month', 'is_weekend',
-            'avg_price_7d', 'avg_quantity_7d', 'price_trend_7d',
-            'min_competitor_price', 'max_competitor_price', 'avg_competitor_price'
-        ]
-        
-        X = features_df[feature_cols].fillna(0)
-        
-        # Scale features
-        X_scaled = self.scaler.fit_transform(X)
+        X = features_df[PRICING_FEATURE_COLUMNS].fillna(0)
         
-        # Train Random Forest model
-        self.model = RandomForestRegressor(n_estimators=50, random_state=42)
-        self.model.fit(X_scaled, y)
+        pricing_model = self.model_registry.get(
+            org_id, product_id, X, y, self._sales_frame(sales_history)['date'].values
+        )
         
         # Predict optimal price using current market conditions
         current_features = X.iloc[-1:].values
-        current_features_scaled = self.scaler.transform(current_features)
+        current_features_scaled = pricing_model.scaler.transform(current_features)
         
-        predicted_revenue_per_unit = self.model.predict(current_features_scaled)[0]
+        predicted_revenue_per_unit = pricing_model.model.predict(current_features_scaled)[0]
         
         # Estimate optimal price based on demand curve
         current_price = features_df['price'].iloc[-1]
         current_quantity = features_df['quantity_sold'].iloc[-1]
         
         if current_quantity > 0:
-            # Simple optimization: adjust price to maximize revenue
-            price_multipliers = np.arange(0.8, 1.3, 0.05)  # Test prices from 80% to 130%
-            best_price = current_price
-            best_revenue = 0
+            # Fit the demand curve once, then score a fine grid of candidate
+            # prices from 80% to 130% of the current price within price bounds
+            demand_curve = self._fit_demand_curve(
+                features_df['price'].values, features_df['quantity_sold'].values
+            )
+            
+            min_price, max_price = self._price_bounds(product_data)
+            low = max(current_price * 0.8, min_price)
+            high = min(current_price * 1.3, max_price)
+            if low > high:
+                return current_price
             
-            for multiplier in price_multipliers:
-                test_price = current_price * multiplier
-                estimated_quantity = self._estimate_quantity_at_price(
-                    test_price, features_df['price'].values, features_df['quantity_sold'].values
-                )
-                estimated_revenue = test_price * estimated_quantity
-                
-                if estimated_revenue > best_revenue:
-                    best_revenue = estimated_revenue
-                    best_price = test_price
+            test_prices = np.linspace(low, high, self.price_grid_points)
+            estimated_revenue = test_prices * self._estimate_quantity_at_price(test_prices, demand_curve)
             
-            return best_price
+            best = np.argmax(estimated_revenue)
+            return test_prices[best] if estimated_revenue[best] > 0 else current_price
         
         return current_price
     
-    def _estimate_quantity_at_price(self, price, historical_prices, historical_quantities):
-        """Estimate quantity demand at given price using linear regression"""
-        if len(historical_prices) < 3:
-            return np.mean(historical_quantities) if len(historical_quantities) > 0 else 1
+    def _fit_demand_curve(self, historical_prices, historical_quantities):
+        """
+        Fit a linear demand curve quantity = slope * price + intercept
         
-        # Simple linear demand model
-        valid_data = [(p, q) for p, q in zip(historical_prices, historical_quantities) if p > 0 and q > 0]
+        Solved in closed form by ordinary least squares over sales with a
+        positive price and quantity. With fewer than 3 such sales demand is
+        taken as flat at the mean quantity.
         
-        if len(valid_data) < 3:
-            return np.mean(historical_quantities)
+        Returns:
+            tuple: (slope, intercept)
+        """
+        prices = np.asarray(historical_prices, dtype='float64')
+        quantities = np.asarray(historical_quantities, dtype='float64')
         
-        prices, quantities = zip(*valid_data)
+        if len(prices) < 3:
+            return 0.0, quantities.mean() if len(quantities) > 0 else 1.0
         
-        # Fit linear regression: quantity = a * price + b
-        X = np.array(prices).reshape(-1, 1)
-        y = np.array(quantities)
+        valid = (prices > 0) & (quantities > 0)
+        if valid.sum() < 3:
+            return 0.0, quantities.mean()
         
-        model = LinearRegression()
-        model.fit(X, y)
+        prices, quantities = prices[valid], quantities[valid]
+        price_deviation = prices - prices.mean()
+        variance = (price_deviation ** 2).sum()
         
-        predicted_quantity = model.predict([[price]])[0]
-        return max(0, predicted_quantity)  # Ensure non-negative quantity
+        # A constant price carries no slope information
+        slope = (price_deviation * (quantities - quantities.mean())).sum() / variance if variance > 0 else 0.0
+        return slope, quantities.mean() - slope * prices.mean()
+    
+    def _estimate_quantity_at_price(self, price, demand_curve):
+        """Estimate quantity demanded at one price or an array of prices"""
+        slope, intercept = demand_curve
+        return np.maximum(0, slope * np.asarray(price, dtype='float64') + intercept)  # Ensure non-negative quantity
+    
+    def _price_bounds(self, product_data):
+        """Allowed price range for recommendations"""
+        min_price = product_data.get('cost_price', 0) * 1.1  # Minimum 10% margin
+        max_price = product_data.get('current_price', 0) * 1.5  # Maximum 50% increase
+        return min_price, max_price
+    
+    def _indexed_elasticity(self, org_id, product_id):
+        """Elasticity precomputed by the elasticity index, or None"""
+        if self.elasticity_index is None or org_id is None or product_id is None:
+            return None
+        
+        # Too few indexed sales only yield the default, estimate per request instead
+        entry = self.elasticity_index.get(org_id, product_id)
+        if entry is None or entry['data_points'] < self.elasticity_index.min_points:
+            return None
+        return entry['elasticity']
     
     def _calculate_demand_elasticity(self, sales_history):
         """Calculate price elasticity of demand"""
@@ -228,13 +272,12 @@ class PricingService:
         current_price = product_data.get('current_price', 0)
         cost_price = product_data.get('cost_price', 0)
         
-        if len(sales_history) == 0:
+        if row_count(sales_history) == 0:
             # Cost-plus pricing with 30% margin
             recommended_price = cost_price * 1.3
         else:
             # Average recent performance
-            recent_sales = sales_history[-5:] if len(sales_history) >= 5 else sales_history
-            avg_quantity = np.mean([s.get('quantity', 0) for s in recent_sales])
+            avg_quantity = np.mean(column(sales_history, 'quantity')[-5:])
             
             if avg_quantity < 2:  # Low sales, reduce price
                 recommended_price = current_price * 0.95
@@ -262,8 +305,7 @@ class PricingService:
         cost_price = product_data.get('cost_price', 0)
         
         # Price bounds
-        min_price = cost_price * 1.1  # Minimum 10% margin
-        max_price = current_price * 1.5  # Maximum 50% increase
+        min_price, max_price = self._price_bounds(product_data)
         
         # Clamp optimal price to bounds
         recommended_price = max(min_price, min(max_price, optimal_price))
@@ -324,34 +366,184 @@ class PricingService:
             }
         }
 
+class RateLimited(RuntimeError):
+    """A fetch was refused locally because its domain had no free request slot"""
+
+class DomainRateLimiter:
+    """Space out requests to each domain by a minimum interval"""
+    
+    def __init__(self, requests_per_second):
+        self.interval = 1.0 / requests_per_second if requests_per_second > 0 else 0
+        self._next_slot = {}
+        self._lock = threading.Lock()
+    
+    def acquire(self, domain, max_wait):
+        """
+        Wait for the domain's next request slot
+        
+        Returns:
+            bool: False, without reserving a slot, if it is further away than max_wait
+        """
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(domain, now))
+            if slot - now > max_wait:
+                return False
+            self._next_slot[domain] = slot + self.interval
+        
+        if slot > now:
+            time.sleep(slot - now)
+        return True
+
 class CompetitorScraper:
+    """
+    Competitor prices from several sources, fetched concurrently
+    
+    Every source runs in a shared thread pool under a per-source timeout;
+    HTTP sources are also held to a per-domain rate limit. Results are
+    cached per source, keyed by the normalized product name and SKU; failed
+    or timed-out sources are cached for a shorter time so they are not
+    retried on every request. Fetches refused by the local rate limit are
+    left uncached and retried on the next request.
+    
+    Besides the built-in mock sources, JSON price endpoints can be added with
+    COMPETITOR_SOURCES, a comma-separated list of name=url entries whose url
+    may contain {query} and {sku} placeholders and which answer with
+    {"price": ..., "url": ...}.
+    """
+    
     def __init__(self):
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
         }
-        
+        self.timeout = float(os.getenv('COMPETITOR_SOURCE_TIMEOUT', 3))
+        self.rate_limiter = DomainRateLimiter(float(os.getenv('COMPETITOR_DOMAIN_RPS', 2)))
+        self.max_workers = int(os.getenv('COMPETITOR_WORKERS', 8))
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='competitor')
+        self.cache = ModelCache(
+            max_size=int(os.getenv('COMPETITOR_CACHE_SIZE', 2048)),
+            ttl=int(os.getenv('COMPETITOR_CACHE_TTL', 3600))
+        )
+        self.failures = ModelCache(
+            max_size=int(os.getenv('COMPETITOR_CACHE_SIZE', 2048)),
+            ttl=int(os.getenv('COMPETITOR_NEGATIVE_TTL', 300))
+        )
+        # requests is imported when the first HTTP source is fetched
+        self._session = None
+        self._session_lock = threading.Lock()
+        
+        # (source name, rate-limited domain or None for in-process sources,
+        #  fetch(product_name, product_sku) -> list of prices)
+        self.sources = [
+            ('Amazon', None, self._fetch_amazon),
+            ('Generic', None, lambda product_name, product_sku: self._scrape_generic_sites(product_name))
+        ]
+        for entry in filter(None, os.getenv('COMPETITOR_SOURCES', '').split(',')):
+            name, url = entry.split('=', 1)
+            self.sources.append((name.strip(), urlparse(url.strip()).netloc, self._http_fetcher(name.strip(), url.strip())))
+    
     def scrape_competitor_prices(self, product_name, product_sku=None):
         """Scrape competitor prices from various sources"""
-        competitors = []
+        return self.scrape_many([(product_name, product_sku)])[0]
+    
+    def scrape_many(self, products):
+        """
+        Competitor prices for many products, all sources fetched concurrently
         
-        try:
-            # Amazon-like scraping (mock implementation)
-            amazon_price = self._scrape_amazon(product_name)
-            if amazon_price:
-                competitors.append({
-                    'source': 'Amazon',
-                    'price': amazon_price,
-                    'url': f'https://amazon.com/search?k={product_name.replace(" ", "+")}'
-                })
+        Args:
+            products: List of (product_name, product_sku) tuples
+        
+        Returns:
+            list: Competitor price lists in the same order as products
+        """
+        results = [[] for _ in products]
+        pending = []
+        
+        for index, (product_name, product_sku) in enumerate(products):
+            product_key = self._product_key(product_name, product_sku)
             
-            # Generic e-commerce scraping
-            generic_prices = self._scrape_generic_sites(product_name)
-            competitors.extend(generic_prices)
+            for source, domain, fetch in self.sources:
+                key = product_key + (source,)
+                cached = self.cache.get(key)
+                if cached is not None:
+                    results[index].extend(cached)
+                elif not self.failures.contains(key):
+                    future = self.executor.submit(self._fetch_source, domain, fetch, product_name, product_sku)
+                    pending.append((index, key, future))
+        
+        # Each fetch enforces its own timeout once started; allow one timeout
+        # per round of queued fetches before giving up on the rest
+        rounds = -(-len(pending) // self.max_workers) if pending else 0
+        deadline = time.monotonic() + self.timeout * (rounds + 1)
+        
+        for index, key, future in pending:
+            try:
+                prices = future.result(timeout=max(0, deadline - time.monotonic()))
+            except RateLimited:
+                # Refused locally, the source itself did not fail
+                continue
+            except Exception as e:
+                # A fetch that never started says nothing about the source
+                if future.cancel():
+                    continue
+                print(f"Competitor source {key[-1]} failed: {str(e) or type(e).__name__}")
+                self.failures.put(key, True)
+                continue
             
-        except Exception as e:
-            print(f"Scraping error: {e}")
+            self.cache.put(key, prices)
+            results[index].extend(prices)
         
-        return competitors
+        return results
+    
+    def _fetch_source(self, domain, fetch, product_name, product_sku):
+        """Fetch one source for one product, respecting the domain's rate limit"""
+        if domain is not None and not self.rate_limiter.acquire(domain, self.timeout):
+            raise RateLimited(f"rate limit for {domain}")
+        return fetch(product_name, product_sku)
+    
+    def _product_key(self, product_name, product_sku):
+        """Cache key from the normalized product name and SKU"""
+        return (' '.join((product_name or '').lower().split()), (product_sku or '').strip().upper())
+    
+    def _get_session(self):
+        """Shared HTTP session for the configured sources, created on first use"""
+        with self._session_lock:
+            if self._session is None:
+                self._session = lazy_import('requests').Session()
+                self._session.headers.update(self.headers)
+            return self._session
+    
+    def _http_fetcher(self, source, url_template):
+        """Fetcher for a JSON price endpoint"""
+        def fetch(product_name, product_sku):
+            response = self._get_session().get(
+                url_template.format(query=quote_plus(product_name or ''), sku=quote_plus(product_sku or '')),
+                timeout=self.timeout
+            )
+            response.raise_for_status()
+            
+            data = response.json()
+            if data.get('price') is None:
+                return []
+            return [{
+                'source': source,
+                'price': float(data['price']),
+                'url': data.get('url', response.url)
+            }]
+        
+        return fetch
+    
+    def _fetch_amazon(self, product_name, product_sku):
+        """Amazon price as a competitor entry"""
+        amazon_price = self._scrape_amazon(product_name)
+        if not amazon_price:
+            return []
+        
+        return [{
+            'source': 'Amazon',
+            'price': amazon_price,
+            'url': f'https://amazon.com/search?k={product_name.replace(" ", "+")}'
+        }]
     
     def _scrape_amazon(self, product_name):
         """Mock Amazon price scraping (replace with actual implementation)"""
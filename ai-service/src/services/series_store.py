@@ -0,0 +1,217 @@
+import os
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+from .columnar import STOCK_COLUMNS, records_to_columns
+from .model_cache import ModelCache
+
+def daily_arrays(dates, balance, quantity):
+    """
+    Bucket date-sorted stock movements into one slot per calendar day
+    
+    Returns:
+        tuple: (days as datetime64[D], closing balance per day with NaN on
+            days without movements, net quantity per day)
+    """
+    if len(dates) == 0:
+        return np.array([], dtype='datetime64[D]'), np.array([]), np.array([])
+    
+    day = dates.astype('datetime64[D]')
+    offset = (day - day[0]).astype('int64')
+    size = offset[-1] + 1
+    
+    # The last movement of each day carries its closing balance
+    closing = np.append(offset[1:] != offset[:-1], True)
+    daily_balance = np.full(size, np.nan)
+    daily_balance[offset[closing]] = balance[closing]
+    
+    daily_quantity = np.bincount(offset, weights=quantity, minlength=size)
+    return day[0] + np.arange(size), daily_balance, daily_quantity
+
+def daily_frame(days, daily_balance, daily_quantity):
+    """Daily ds/y frame with the balance on days without movements interpolated"""
+    known = ~np.isnan(daily_balance)
+    positions = np.arange(len(daily_balance))
+    y = np.interp(positions, positions[known], daily_balance[known]) if known.any() else daily_balance
+    
+    return pd.DataFrame({
+        'ds': days.astype('datetime64[ns]'),
+        'y': y,
+        'quantity': daily_quantity
+    })
+
+class PreparedStock:
+    """
+    Stock data parsed and sorted once, shared by prediction and insights
+    
+    frame holds the date-sorted movements; daily holds the same series
+    bucketed to one row per day for Prophet/ARIMA and is built on first use,
+    unless the series store already maintains it.
+    """
+    
+    def __init__(self, frame, daily=None):
+        self.frame = frame
+        self._daily = daily
+    
+    def __len__(self):
+        return len(self.frame)
+    
+    @property
+    def daily(self):
+        """Daily ds/y series with missing dates interpolated"""
+        if self._daily is None:
+            self._daily = daily_frame(*daily_arrays(
+                self.frame['date'].values,
+                self.frame['balance'].to_numpy(dtype='float64'),
+                self.frame['quantity'].to_numpy(dtype='float64')
+            ))
+        
+        return self._daily
+    
+    def columns(self):
+        """Date and balance columns in the columnar format"""
+        return {'date': self.frame['date'].values, 'balance': self.frame['balance'].to_numpy(dtype='float64')}
+
+class StockSeriesStore:
+    """
+    Incrementally maintained daily stock series per product
+    
+    Each entry keeps the movements of the history window together with the
+    per-day balance arrays and a ledger createdAt watermark. A read only
+    loads ledger entries created after the watermark and appends them;
+    movements backdated before the end of the series force a full reload.
+    Entries are immutable, so concurrent readers never see a partial update.
+    """
+    
+    def __init__(self, data_service, days=90):
+        self.data_service = data_service
+        self.days = days
+        self._series = ModelCache(
+            max_size=int(os.getenv('SERIES_STORE_SIZE', 1024)),
+            ttl=int(os.getenv('SERIES_STORE_TTL', 86400))
+        )
+    
+    def get(self, org_id, product_id):
+        """
+        Get a product's prepared stock series, applying new movements
+        
+        Returns:
+            PreparedStock: Movements in the window plus the daily series
+        """
+        key = (org_id, product_id)
+        entry = self._series.get(key)
+        cutoff = np.datetime64(datetime.now() - timedelta(days=self.days), 'ns')
+        
+        update = self._updates(org_id, product_id, entry['watermark'] if entry else None)
+        
+        # Backdated movements force a reload of the whole window
+        if update is not None and entry is not None and len(update[0]['date']) \
+                and len(entry['movements']['date']) and update[0]['date'][0] < entry['movements']['date'][-1]:
+            update = self._updates(org_id, product_id, None)
+            entry = None
+        
+        # Without MongoDB (or when it fails) there is no watermark to follow,
+        # load the window the same way get_stock_data does
+        if update is None:
+            stock_data = self.data_service.get_stock_data(org_id, product_id, self.days)
+            return PreparedStock(self._frame(records_to_columns(stock_data, STOCK_COLUMNS)))
+        
+        movements, watermark = update
+        
+        if entry is None:
+            entry = self._build(movements, watermark)
+        elif len(movements['date']):
+            entry = self._append(entry, movements, watermark)
+        else:
+            entry = dict(entry, watermark=watermark)
+        
+        entry = self._trim(entry, cutoff)
+        self._series.put(key, entry)
+        
+        return PreparedStock(self._frame(entry['movements']), daily_frame(*entry['daily']))
+    
+    def invalidate(self, org_id=None, product_id=None):
+        """Drop stored series for an org and/or product"""
+        return self._series.invalidate(org_id, product_id)
+    
+    def stats(self):
+        """Store size and hit/miss counters"""
+        return self._series.stats()
+    
+    def _updates(self, org_id, product_id, since):
+        """Ledger movements created after since, or None if they cannot be loaded"""
+        try:
+            return self.data_service.get_stock_updates(org_id, product_id, since, self.days)
+        except Exception as e:
+            print(f"Error loading stock updates for {product_id}: {e}")
+            return None
+    
+    def _build(self, movements, watermark):
+        """Entry for a freshly loaded window"""
+        return {
+            'movements': movements,
+            'daily': daily_arrays(movements['date'], movements['balance'], movements['quantity']),
+            'watermark': watermark
+        }
+    
+    def _append(self, entry, movements, watermark):
+        """Entry with date-sorted movements at or after its last movement appended"""
+        days, daily_balance, daily_quantity = entry['daily']
+        new_days, new_balance, new_quantity = daily_arrays(
+            movements['date'], movements['balance'], movements['quantity']
+        )
+        
+        if len(days) and new_days[0] == days[-1]:
+            # The first new day continues the series' last day
+            daily_balance = daily_balance.copy()
+            daily_quantity = daily_quantity.copy()
+            daily_balance[-1] = new_balance[0]
+            daily_quantity[-1] += new_quantity[0]
+            new_days, new_balance, new_quantity = new_days[1:], new_balance[1:], new_quantity[1:]
+        
+        if len(new_days):
+            gap = days[-1] + np.arange(1, (new_days[0] - days[-1]).astype('int64')) if len(days) else new_days[:0]
+            days = np.concatenate([days, gap, new_days])
+            daily_balance = np.concatenate([daily_balance, np.full(len(gap), np.nan), new_balance])
+            daily_quantity = np.concatenate([daily_quantity, np.zeros(len(gap)), new_quantity])
+        
+        return {
+            'movements': {
+                name: np.concatenate([entry['movements'][name], movements[name]])
+                for name in STOCK_COLUMNS
+            },
+            'daily': (days, daily_balance, daily_quantity),
+            'watermark': watermark
+        }
+    
+    def _trim(self, entry, cutoff):
+        """Entry with movements older than the history window dropped"""
+        dates = entry['movements']['date']
+        start = np.searchsorted(dates, cutoff)
+        if start == 0:
+            return entry
+        
+        movements = {name: values[start:] for name, values in entry['movements'].items()}
+        days, daily_balance, daily_quantity = entry['daily']
+        
+        if not len(movements['date']):
+            first = len(days)
+        else:
+            first_day = movements['date'][0].astype('datetime64[D]')
+            first = np.searchsorted(days, first_day)
+        
+        days, daily_balance, daily_quantity = days[first:], daily_balance[first:], daily_quantity[first:].copy()
+        if len(days):
+            # Dropped movements may share the first remaining day
+            same_day = movements['date'].astype('datetime64[D]') == days[0]
+            daily_quantity[0] = movements['quantity'][same_day].sum()
+        
+        return {
+            'movements': movements,
+            'daily': (days, daily_balance, daily_quantity),
+            'watermark': entry['watermark']
+        }
+    
+    def _frame(self, movements):
+        """Movements frame in the shape ForecastingService.prepare builds"""
+        return pd.DataFrame({name: movements[name] for name in STOCK_COLUMNS})
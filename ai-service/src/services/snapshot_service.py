@@ -0,0 +1,281 @@
+import os
+import threading
+from datetime import datetime, timedelta
+
+# Dashboard buckets, in display order
+TREND_BUCKETS = ('critical_stock', 'low_stock', 'healthy_stock', 'no_data')
+
+def classify_depletion(product, prediction):
+    """
+    Place one product's depletion prediction in a stock trend bucket
+    
+    Returns:
+        tuple: (bucket name, dashboard row)
+    """
+    days_remaining = prediction.get('days_remaining')
+    row = {
+        'product_id': product['product_id'],
+        'name': product.get('name', ''),
+        'current_stock': product.get('current_stock', 0)
+    }
+    
+    if days_remaining is None or not prediction.get('success'):
+        return 'no_data', row
+    
+    if days_remaining < 7:
+        bucket = 'critical_stock'
+    elif days_remaining <= 30:
+        bucket = 'low_stock'
+    else:
+        bucket = 'healthy_stock'
+        days_remaining = min(days_remaining, 90)  # Cap at 90 days
+    
+    row['days_remaining'] = days_remaining
+    return bucket, row
+
+def summarize_trends(trends):
+    """Bucket counts for a stock trends dict"""
+    return {
+        'critical_count': len(trends['critical_stock']),
+        'low_count': len(trends['low_stock']),
+        'healthy_count': len(trends['healthy_stock']),
+        'no_data_count': len(trends['no_data'])
+    }
+
+class DepletionSnapshotService:
+    """
+    Precomputed per-org stock trend snapshots
+    
+    A background scheduler forecasts every active product of each org and
+    keeps the bucketed results, so the dashboard is served without running
+    any model. Later runs only re-forecast products whose ledgers received
+    entries since the previous run; a full refresh every
+    SNAPSHOT_FULL_REFRESH seconds lets unchanged forecasts age correctly.
+    Snapshots are also written to MongoDB so every worker can serve them.
+    When the scheduler is not running, reading a snapshot older than
+    SNAPSHOT_INTERVAL schedules a refresh instead.
+    """
+    
+    def __init__(self, data_service, forecasting_service):
+        self.data_service = data_service
+        self.forecasting_service = forecasting_service
+        self.interval = int(os.getenv('SNAPSHOT_INTERVAL', 900))
+        self.full_refresh = int(os.getenv('SNAPSHOT_FULL_REFRESH', 86400))
+        self.chunk_size = int(os.getenv('SNAPSHOT_CHUNK_SIZE', 500))
+        self._snapshots = {}
+        self._orgs = set()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def get(self, org_id):
+        """Latest snapshot for an org, or None if it has never been built"""
+        with self._lock:
+            snapshot = self._snapshots.get(org_id)
+        
+        # Another worker may have refreshed the org since this one last did
+        if snapshot is None or self._age(snapshot) > self.interval:
+            stored = self._load(org_id)
+            if stored is not None and (snapshot is None or stored['generated_at'] > snapshot['generated_at']):
+                with self._lock:
+                    self._snapshots[org_id] = stored
+                snapshot = stored
+        
+        return snapshot
+    
+    def view(self, org_id):
+        """Stock trends for an org as served by the dashboard, or None"""
+        snapshot = self.get(org_id)
+        if snapshot is None:
+            return None
+        
+        # Without the scheduler, stale reads refresh the org in the background
+        # and are answered from the current snapshot meanwhile
+        if self._thread is None and self._age(snapshot) > self.interval:
+            self.request_refresh(org_id)
+        
+        return {
+            'org_id': org_id,
+            'summary': snapshot['summary'],
+            'trends': snapshot['trends'],
+            'snapshot': {
+                'generated_at': snapshot['generated_at'].isoformat(),
+                'age_seconds': round(self._age(snapshot), 1),
+                'product_count': len(snapshot['products']),
+                'refreshed_products': snapshot['refreshed_products'],
+                'full_refresh': snapshot['full_refresh']
+            }
+        }
+    
+    def refresh(self, org_id, full=False):
+        """
+        Rebuild an org's snapshot, re-forecasting only changed products
+        
+        Args:
+            org_id: Organization ID
+            full: Re-forecast every product regardless of ledger changes
+        
+        Returns:
+            dict: The new snapshot
+        """
+        started_at = datetime.now()
+        # Ledger createdAt values come back from MongoDB as naive UTC
+        watermark = datetime.utcnow()
+        previous = self.get(org_id)
+        products = {p['product_id']: p for p in self.data_service.get_all_products_for_org(org_id)}
+        
+        full = (
+            full or previous is None
+            or started_at - previous['full_refreshed_at'] > timedelta(seconds=self.full_refresh)
+        )
+        
+        if full:
+            entries = {}
+            targets = list(products)
+        else:
+            # Keep entries of unchanged products, drop deactivated ones
+            entries = {p: entry for p, entry in previous['products'].items() if p in products}
+            changed = self.data_service.get_changed_product_ids(
+                org_id, list(entries), previous['watermark']
+            )
+            targets = [p for p in products if p in changed or p not in entries]
+        
+        for start in range(0, len(targets), self.chunk_size):
+            chunk = targets[start:start + self.chunk_size]
+            stock_by_product = self.data_service.get_stock_data_bulk(org_id, chunk)
+            info_by_product = {p: products[p] for p in chunk}
+            
+            try:
+                results = self.forecasting_service.predict_batch(stock_by_product, info_by_product, org_id)
+            except Exception as e:
+                print(f"Snapshot forecast failed for {org_id}: {e}")
+                results = {}
+            
+            for product_id in chunk:
+                prediction = results.get(product_id) or {'success': False}
+                bucket, row = classify_depletion(products[product_id], prediction)
+                entries[product_id] = {'bucket': bucket, 'row': row}
+        
+        trends = {bucket: [] for bucket in TREND_BUCKETS}
+        for entry in entries.values():
+            trends[entry['bucket']].append(entry['row'])
+        for bucket in ('critical_stock', 'low_stock'):
+            trends[bucket].sort(key=lambda row: row['days_remaining'])
+        
+        snapshot = {
+            'org_id': org_id,
+            # Ledger entries written while this run was reading are picked up next time
+            'watermark': watermark,
+            'generated_at': datetime.now(),
+            'full_refreshed_at': started_at if full else previous['full_refreshed_at'],
+            'full_refresh': full,
+            'refreshed_products': len(targets),
+            'products': entries,
+            'trends': trends,
+            'summary': summarize_trends(trends)
+        }
+        
+        with self._lock:
+            self._snapshots[org_id] = snapshot
+        self._save(snapshot)
+        
+        return snapshot
+    
+    def request_refresh(self, org_id):
+        """Schedule an org for refreshing without waiting for the result"""
+        with self._lock:
+            self._orgs.add(org_id)
+            if org_id in self._refreshing:
+                return
+            if self._thread is None:
+                self._refreshing.add(org_id)
+        
+        if self._thread is not None:
+            self._wake.set()
+            return
+        
+        threading.Thread(target=self._refresh_once, args=(org_id,), daemon=True).start()
+    
+    def _refresh_once(self, org_id):
+        """Refresh one org, logging rather than raising failures"""
+        try:
+            self.refresh(org_id)
+        except Exception as e:
+            print(f"Snapshot refresh failed for {org_id}: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(org_id)
+    
+    def start(self):
+        """Start the background scheduler thread"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='depletion-snapshots', daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        """Stop the background scheduler after its current org"""
+        self._stop.set()
+        self._wake.set()
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout=5)
+    
+    def _run(self):
+        """Scheduler loop: refresh every active org, then sleep for the interval"""
+        while not self._stop.is_set():
+            with self._lock:
+                requested = set(self._orgs)
+            org_ids = requested.union(self.data_service.get_active_org_ids())
+            
+            for org_id in sorted(org_ids):
+                if self._stop.is_set():
+                    break
+                with self._lock:
+                    if org_id in self._refreshing:
+                        continue
+                    self._refreshing.add(org_id)
+                self._refresh_once(org_id)
+            
+            self._wake.wait(self.interval)
+            self._wake.clear()
+    
+    def _age(self, snapshot):
+        """Seconds since a snapshot was generated"""
+        return (datetime.now() - snapshot['generated_at']).total_seconds()
+    
+    def _save(self, snapshot):
+        """Persist a snapshot to MongoDB, if available"""
+        try:
+            db = self.data_service.connect_db()
+            if db is not None:
+                document = {key: value for key, value in snapshot.items() if key != 'products'}
+                # Product IDs are not safe as document keys, store a list
+                document['products'] = [
+                    {'product_id': product_id, **entry}
+                    for product_id, entry in snapshot['products'].items()
+                ]
+                db.ai_depletion_snapshots.replace_one({'org_id': snapshot['org_id']}, document, upsert=True)
+        except Exception as e:
+            print(f"Error saving depletion snapshot: {e}")
+    
+    def _load(self, org_id):
+        """Load an org's snapshot from MongoDB, if available"""
+        try:
+            db = self.data_service.connect_db()
+            if db is not None:
+                document = db.ai_depletion_snapshots.find_one({'org_id': org_id}, {'_id': 0})
+                if document:
+                    document['products'] = {
+                        entry.pop('product_id'): entry for entry in document['products']
+                    }
+                    return document
+        except Exception as e:
+            print(f"Error loading depletion snapshot: {e}")
+        
+        return None
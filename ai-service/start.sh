@@ -3,4 +3,6 @@ echo "🤖 Starting AI Credit Service..."
 python3 -m venv venv
 source venv/bin/activate
 pip install -r requirements.txt
+python credit_model.py --if-missing
+python mongo_indexes.py
 python ai_credit_service.py
\ No newline at end of file
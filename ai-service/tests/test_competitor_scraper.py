@@ -0,0 +1,139 @@
+"""
+CompetitorScraper against local stand-in price endpoints
+
+Run from ai-service/: python -m unittest discover tests
+"""
+import json
+import os
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+from src.services.pricing_service import CompetitorScraper
+
+SOURCE_TIMEOUT = 0.5
+
+def start_price_server(delay):
+    """Serve {"price": ...} after delay seconds, counting requests per query"""
+    hits = {}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+        
+        def do_GET(self):
+            query = parse_qs(urlparse(self.path).query).get('q', [''])[0]
+            with lock:
+                hits[query] = hits.get(query, 0) + 1
+            
+            time.sleep(delay)
+            body = json.dumps({'price': 10.0 + len(query)}).encode()
+            try:
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.end_headers()
+                self.wfile.write(body)
+            except OSError:
+                pass  # The client gave up after its timeout
+    
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, hits
+
+class CompetitorScraperTest(unittest.TestCase):
+    def setUp(self):
+        self.fast, self.fast_hits = start_price_server(0.2)
+        self.slow, self.slow_hits = start_price_server(SOURCE_TIMEOUT * 3)
+        self.addCleanup(self.fast.shutdown)
+        self.addCleanup(self.slow.shutdown)
+    
+    def scraper(self, rps=100):
+        sources = ','.join([
+            f"Fast=http://127.0.0.1:{self.fast.server_port}/?q={{query}}&sku={{sku}}",
+            f"Slow=http://127.0.0.1:{self.slow.server_port}/?q={{query}}"
+        ])
+        env = {
+            'COMPETITOR_SOURCES': sources,
+            'COMPETITOR_SOURCE_TIMEOUT': str(SOURCE_TIMEOUT),
+            'COMPETITOR_DOMAIN_RPS': str(rps),
+            'COMPETITOR_WORKERS': '16'
+        }
+        with mock.patch.dict(os.environ, env):
+            return CompetitorScraper()
+    
+    def sources_of(self, prices):
+        return {price['source'] for price in prices}
+    
+    def test_fetches_sources_concurrently(self):
+        scraper = self.scraper()
+        products = [(f'product {i}', None) for i in range(8)]
+        
+        started = time.perf_counter()
+        results = scraper.scrape_many(products)
+        elapsed = time.perf_counter() - started
+        
+        self.assertTrue(all('Fast' in self.sources_of(prices) for prices in results))
+        # Eight 0.2s fetches plus the slow source, far below running them in turn
+        self.assertLess(elapsed, 8 * 0.2 + len(products) * SOURCE_TIMEOUT)
+        self.assertLess(elapsed, SOURCE_TIMEOUT * 4)
+    
+    def test_slow_source_times_out(self):
+        scraper = self.scraper()
+        
+        started = time.perf_counter()
+        prices = scraper.scrape_competitor_prices('widget')
+        elapsed = time.perf_counter() - started
+        
+        self.assertIn('Fast', self.sources_of(prices))
+        self.assertNotIn('Slow', self.sources_of(prices))
+        self.assertLess(elapsed, SOURCE_TIMEOUT * 2.5)
+    
+    def test_cache_hit_skips_fetch(self):
+        scraper = self.scraper()
+        scraper.scrape_competitor_prices('Blue  Widget', 'ab1')
+        
+        started = time.perf_counter()
+        prices = scraper.scrape_competitor_prices('blue widget', 'AB1 ')
+        elapsed = time.perf_counter() - started
+        
+        self.assertIn('Fast', self.sources_of(prices))
+        self.assertEqual(sum(self.fast_hits.values()), 1)
+        self.assertLess(elapsed, 0.1)
+    
+    def test_failed_source_is_negatively_cached(self):
+        scraper = self.scraper()
+        scraper.scrape_competitor_prices('gadget')
+        self.assertTrue(scraper.failures.contains(('gadget', '', 'Slow')))
+        
+        started = time.perf_counter()
+        prices = scraper.scrape_competitor_prices('gadget')
+        
+        self.assertNotIn('Slow', self.sources_of(prices))
+        self.assertEqual(self.slow_hits, {'gadget': 1})
+        self.assertLess(time.perf_counter() - started, 0.1)
+    
+    def test_rate_limited_fetches_are_not_negatively_cached(self):
+        scraper = self.scraper(rps=1)
+        results = scraper.scrape_many([(f'item {i}', None) for i in range(5)])
+        
+        refused = [i for i, prices in enumerate(results) if 'Fast' not in self.sources_of(prices)]
+        self.assertTrue(refused)
+        for i in refused:
+            self.assertFalse(scraper.failures.contains((f'item {i}', '', 'Fast')))
+    
+    def test_builtin_sources_are_not_rate_limited(self):
+        with mock.patch.dict(os.environ, {'COMPETITOR_SOURCES': '', 'COMPETITOR_DOMAIN_RPS': '1'}):
+            scraper = CompetitorScraper()
+        
+        started = time.perf_counter()
+        results = scraper.scrape_many([(f'thing {i}', None) for i in range(30)])
+        
+        self.assertTrue(all(results))
+        self.assertLess(time.perf_counter() - started, 0.5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -185,13 +185,18 @@ exports.createInvoice = async (req, res) => {
 exports.getInvoices = async (req, res) => {
   try {
     const { orgID } = req.user;
-    const { page = 1, limit = 10, status, customer } = req.query;
+    const { page = 1, limit = 10, status, customer, productID, days, fields } = req.query;
 
     const filter = { orgID };
     if (status) filter.status = status;
     if (customer) filter['customer.name'] = new RegExp(customer, 'i');
+    if (productID) filter['items.productID'] = productID;
+    if (days) filter.createdAt = { $gte: new Date(Date.now() - parseInt(days) * 24 * 60 * 60 * 1000) };
 
-    const invoices = await Invoice.find(filter)
+    // Optional projection, e.g. fields=createdAt,items.productID,items.quantity
+    const projection = fields ? fields.split(',').join(' ') : null;
+
+    const invoices = await Invoice.find(filter, projection)
       .sort({ createdAt: -1 })
       .limit(limit * 1)
       .skip((page - 1) * limit);
@@ -6,9 +6,11 @@ const { asyncHandler } = require('../middleware/errorHandler');
 exports.getStockMovements = asyncHandler(async (req, res) => {
   try {
     const { orgID } = req.user;
-    const { productID, limit = 50 } = req.query;
+    const { productID, limit = 50, page = 1, days } = req.query;
 
-    const movements = await stockService.getStockMovements(orgID, productID, parseInt(limit));
+    const movements = await stockService.getStockMovements(
+      orgID, productID, parseInt(limit), parseInt(page), days ? parseInt(days) : null
+    );
 
     res.json({
       success: true,
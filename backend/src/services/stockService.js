@@ -132,12 +132,14 @@ class StockService {
   }
   
   // Get stock movements
-  async getStockMovements(orgID, productID = null, limit = 50) {
+  async getStockMovements(orgID, productID = null, limit = 50, page = 1, days = null) {
     const filter = { orgID };
     if (productID) filter.productID = productID;
+    if (days) filter.createdAt = { $gte: new Date(Date.now() - days * 24 * 60 * 60 * 1000) };
     
     return await Stock.find(filter)
       .sort({ createdAt: -1 })
+      .skip((page - 1) * limit)
       .limit(limit)
       .populate('productID', 'name sku');
   }